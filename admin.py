@@ -1,7 +1,9 @@
 
 from shop_algorithms import ProductHeap
-import json
 from product_assigner import assign_products_to_racks
+from layout_initializer import (
+    build_layout, grid_distances, read_edge_file, read_product_file, split_cashiers)
+from storage import LAYOUT_FILE, open_storage
 
 class InitAbort(Exception):
     """Raised when user types 'done' to abort layout setup."""
@@ -46,6 +48,20 @@ def get_distance_input(a, b):
         except ValueError:
             print(" Enter a number, 0/blank for no path, or 'done' to cancel.")
 
+def parse_cashiers(rack_ids):
+    """
+    Prompt for the racks that hold a till, comma separated.
+    Blank keeps the single cashier at the first rack.
+    """
+    while True:
+        raw = input(" Cashier racks (comma separated, blank = first rack): ").strip()
+        if raw.lower() == "done":
+            raise InitAbort
+        cashiers, unknown = split_cashiers(raw, rack_ids)
+        if not unknown:
+            return cashiers
+        print(f" Unknown racks: {', '.join(unknown)}")
+
 def collect_distances(rack_ids):
     """
     Build a symmetric distance map between all rack pairs.
@@ -61,20 +77,30 @@ def collect_distances(rack_ids):
             distances[(b, a)] = dist
     return distances
 
-def save_layout(data, filename="layout_data.json"):
-    # preserve existing inventory if present so we don't clobber product inventory
-    try:
-        with open(filename, "r") as f:
-            existing = json.load(f)
-    except FileNotFoundError:
-        existing = {}
+def choose_distance_source():
+    """
+    Ask how rack distances should be filled in.
+    1 = prompt for every pair, 2 = grid aisles, 3 = CSV edge list.
+    """
+    while True:
+        raw = input(" Distances: 1) enter each pair  2) generate grid aisles  3) import CSV edge list: ").strip().lower()
+        if raw == "done":
+            raise InitAbort
+        if raw in ("", "1", "2", "3"):
+            return raw or "1"
+        print(" Choose 1, 2 or 3.")
 
-    if isinstance(existing, dict) and "inventory" in existing:
-        # copy inventory into new data unless already provided
-        data.setdefault("inventory", existing.get("inventory"))
+def read_csv(reader, path):
+    # a missing or unreadable file ends the setup rather than the admin session
+    try:
+        return reader(path)
+    except OSError as e:
+        print(f" Could not read {path}: {e}")
+        raise InitAbort
 
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=4)
+def save_layout(data, filename=LAYOUT_FILE):
+    # the storage backend keeps existing inventory so we don't clobber it
+    open_storage(filename).save_layout(data)
     print(f"\nSaved layout to {filename}")
 
 def initialize_layout():
@@ -83,36 +109,63 @@ def initialize_layout():
     Catches InitAbort and returns to admin menu.
     """
     try:
-        # 1) parse and generate rack IDs
-        rows, cols = parse_layout_size()
-        rack_ids = generate_rack_ids(rows, cols)
-        print(f"\n Generated racks: {rack_ids}\n")
+        # 1) rack IDs: generated from the layout size, or the racks a CSV edge list names
+        source = choose_distance_source()
+        if source == "3":
+            path = input(" Edge CSV file (from,to,distance): ").strip()
+            rack_ids, distances = read_csv(read_edge_file, path)
+            if not rack_ids:
+                print(f" No racks in {path}.")
+                raise InitAbort
+            print(f"\n Read {len(rack_ids)} racks from {path}\n")
+        else:
+            rows, cols = parse_layout_size()
+            rack_ids = generate_rack_ids(rows, cols)
+            print(f"\n Generated racks: {rack_ids}\n")
 
         # 2) distances
-        print(" Fill in distances between racks:")
-        distances = collect_distances(rack_ids)
+        if source == "1":
+            print(" Fill in distances between racks:")
+            distances = collect_distances(rack_ids)
+        elif source == "2":
+            distances = grid_distances(rows, cols)
+            print(f" Connected {len(distances) // 2} neighbouring rack pairs.")
 
         # 3) product assignment
-        print("\n Assign products to racks:")
-        product_map = assign_products_to_racks(rack_ids)
-
-        # 4) assemble and save
-        layout_data = {
-            "rack_ids": rack_ids,
-            "distances": {
-                f"{a}->{b}": ("∞" if d == float('inf') else d)
-                for (a, b), d in distances.items()
-            },
-            "products": product_map
-        }
+        if source == "1":
+            print("\n Assign products to racks:")
+            product_map = assign_products_to_racks(rack_ids)
+        else:
+            # prompting per rack does not scale, take a file or leave racks empty
+            path = input(" Rack products CSV (rack,product) or blank to leave unassigned: ").strip()
+            product_map = read_csv(read_product_file, path) if path else {}
+
+        # 4) cashier racks
+        cashiers = parse_cashiers(rack_ids)
+
+        # 5) assemble and save
+        if source == "1":
+            layout_data = {
+                "rack_ids": rack_ids,
+                "distances": {
+                    f"{a}->{b}": ("∞" if d == float('inf') else d)
+                    for (a, b), d in distances.items()
+                },
+                "products": product_map,
+                "cashiers": cashiers
+            }
+        else:
+            # bulk sources only list real edges, keep the file linear in size
+            layout_data = build_layout(rack_ids, distances, product_map, cashiers)
         save_layout(layout_data)
 
     except InitAbort:
         print("\nLayout initialization canceled. Returning to Admin Menu.")
 
 def run_admin_menu():
-	products = ProductHeap()
-	products.load_from_file("layout_data.json")
+	# shared with the tills: edits lock and reload so reserved stock is kept
+	products = ProductHeap(journal=True, filename=LAYOUT_FILE, shared=True)
+	products.load_from_file(LAYOUT_FILE)
 
 	while True:
 		print("\n--- Admin Menu ---")
@@ -134,16 +187,17 @@ def run_admin_menu():
 			except ValueError:
 				print("Invalid input.")
 				continue
-			products.add_product(name, brand, price, qty)
-			products.save_to_file("layout_data.json")
+			with products.editing():
+				products.add_product(name, brand, price, qty)
+			products.save_to_file(LAYOUT_FILE)
 			print(f" Added {brand} {name} – Rs {price:.2f} (Qty: {qty})")
 
-			# NEW: ask admin if they'd like to assign this product to a rack in layout_data.json
+			# NEW: ask admin if they'd like to assign this product to a rack in the layout
 			assign = input("Assign this product to a rack? (y/N): ").strip().lower()
 			if assign == "y":
+				layout_store = open_storage(LAYOUT_FILE)
 				try:
-					with open("layout_data.json", "r") as lf:
-						layout = json.load(lf)
+					layout = layout_store.load_layout()
 				except FileNotFoundError:
 					print(" layout_data.json not found. Initialize layout first (Admin -> Initialize shop layout).")
 				else:
@@ -154,6 +208,8 @@ def run_admin_menu():
 					print("\nAvailable racks and current assignments:")
 					for r in rack_ids:
 						current = products_map.get(r, "unassigned")
+						if isinstance(current, list):
+							current = ", ".join(current)
 						print(f"  {r}: {current}")
 
 					while True:
@@ -165,9 +221,7 @@ def run_admin_menu():
 							print(" Invalid rack id. Choose from the list above.")
 							continue
 						# assign product name (store as provided name)
-						products_map[rack_choice] = name
-						layout["products"] = products_map
-						save_layout(layout)
+						layout_store.assign_product(rack_choice, name)
 						print(f" Assigned product '{name}' to {rack_choice}.")
 						break
 
@@ -180,8 +234,10 @@ def run_admin_menu():
 			price_val = float(price) if price else None
 			qty_val   = int(qty)   if qty   else None
 
-			if products.update_product(name, brand, price_val, qty_val):
-				products.save_to_file("layout_data.json")
+			with products.editing():
+				updated = products.update_product(name, brand, price_val, qty_val)
+			if updated:
+				products.save_to_file(LAYOUT_FILE)
 				print(" Updated.")
 			else:
 				print(" Not found.")
@@ -190,12 +246,14 @@ def run_admin_menu():
 			# delete product
 			name  = input("Name to delete: ").strip()
 			brand = input("Brand: ").strip()
-			products.delete_product(name, brand)
-			products.save_to_file("layout_data.json")
+			with products.editing():
+				products.delete_product(name, brand)
+			products.save_to_file(LAYOUT_FILE)
 			print(" Deleted.")
 
 		elif choice == "4":
-			# view all grouped
+			# view all grouped, with what the tills have sold since
+			products.reload_if_changed(LAYOUT_FILE)
 			grouped = products.show_all_grouped()
 			if not grouped:
 				print("No products.")
@@ -0,0 +1,8 @@
+"""
+Seeded benchmarks for the shop's hot paths.
+
+    python -m benchmarks.run --scale medium --output results.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.2
+
+Run from the repository root so the shop modules are importable.
+"""
@@ -0,0 +1,54 @@
+import random
+from layout_initializer import build_layout, generate_rack_ids, grid_distances
+
+SYLLABLES = ["ka", "lo", "mi", "su", "ra", "ne", "to", "vi", "pa", "de",
+             "chi", "mo", "ba", "ri", "ku", "sa", "le", "no", "ta", "gu"]
+
+def make_name(rng, syllables=3):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+def make_layout(rows, cols, density=0.0, products=None, seed=0):
+    """
+    rows x cols grid layout, plus random shortcuts between racks: density is
+    the fraction of racks that get one extra two-way edge. products, if
+    given, are spread over the racks round-robin.
+    """
+    rng = random.Random(seed)
+    rack_ids = generate_rack_ids(rows, cols)
+    distances = grid_distances(rows, cols)
+    for _ in range(int(density * len(rack_ids))):
+        a, b = rng.sample(rack_ids, 2)
+        weight = float(rng.randint(1, max(rows, cols)))
+        distances[(a, b)] = weight
+        distances[(b, a)] = weight
+    product_map = {}
+    for i, product in enumerate(products or []):
+        rack = rack_ids[i % len(rack_ids)]
+        product_map.setdefault(rack, []).append(product)
+    return build_layout(rack_ids, distances, product_map)
+
+def make_inventory(skus, brands_per_product=4, seed=0):
+    """
+    skus (price, name, brand, quantity) records with unique name/brand
+    pairs, brands_per_product brands for each product name.
+    """
+    rng = random.Random(seed)
+    brands = sorted({make_name(rng, 2) for _ in range(1000)})
+    names = set()
+    while len(names) * brands_per_product < skus:
+        names.add(make_name(rng, rng.randint(3, 5)))
+    records = []
+    for name in sorted(names):
+        for brand in rng.sample(brands, brands_per_product):
+            if len(records) == skus:
+                return records
+            records.append((round(rng.uniform(10, 5000), 2), name, brand, rng.randint(0, 500)))
+    return records
+
+def make_shopping_lists(products, count, size, seed=0):
+    """
+    count shopping lists of size distinct products each.
+    """
+    rng = random.Random(seed)
+    products = sorted(set(products))
+    return [rng.sample(products, min(size, len(products))) for _ in range(count)]
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks.generators import make_inventory, make_layout, make_shopping_lists
+from compact_inventory import CompactInventory
+from customer_route import build_product_index, find_optimal_route, racks_for_products
+from distance_matrix import load_matrix
+from shop_algorithms import CartManager, ProductHeap
+
+# what each --scale runs; larger scales include the smaller sizes
+SCALES = {
+    "small": {
+        "skus": [10**3, 10**4],
+        "grids": [(10, 10)],
+        "route_sizes": [5, 10, 15, 30],
+        "cart_lines": [10, 100],
+    },
+    "medium": {
+        "skus": [10**3, 10**4, 10**5],
+        "grids": [(10, 10), (30, 30)],
+        "route_sizes": [5, 10, 15, 30],
+        "cart_lines": [10, 100, 1000],
+    },
+    "large": {
+        "skus": [10**3, 10**4, 10**5, 10**6],
+        "grids": [(10, 10), (30, 30), (100, 100)],
+        "route_sizes": [5, 10, 15, 30],
+        "cart_lines": [10, 100, 1000],
+    },
+}
+# slowdown over the baseline median that counts as a regression (0.2 = 20%)
+DEFAULT_THRESHOLD = 0.2
+# timed runs per benchmark; the median is what gets compared
+DEFAULT_REPEAT = 5
+# queries per search run and shopping lists per route run
+SEARCH_BATCH = 200
+ROUTE_BATCH = 5
+# the heuristic's budget, kept short so large lists do not dominate a run
+ROUTE_TIME_BUDGET = 0.2
+# inventory size the checkout benchmark settles against
+CHECKOUT_SKUS = 10**4
+INVENTORY_BENCHMARKS = (
+    "load_from_file", "load_ndjson", "load_snapshot", "search_by_keyword", "save_to_file",
+    "compact_load_from_file", "compact_search_by_keyword")
+ROUTE_BENCHMARKS = ("load_matrix", "find_optimal_route")
+
+def measure(run, repeat, setup=None, ops=1):
+    """
+    Time run() repeat times; with setup, run(setup()) with setup untimed.
+    Figures are seconds per operation when one run does ops operations.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        started = time.perf_counter()
+        if setup is not None:
+            run(state)
+        else:
+            run()
+        times.append((time.perf_counter() - started) / ops)
+    return {"median": statistics.median(times), "min": min(times), "repeat": repeat, "ops": ops}
+
+def load_heap(records, workdir):
+    filename = os.path.join(workdir, f"inventory_{len(records)}.json")
+    with open(filename, "w") as f:
+        json.dump({"inventory": records}, f)
+    heap = ProductHeap(filename=filename)
+    heap.load_from_file(filename)
+    return heap, filename
+
+def bench_inventory(skus, repeat, seed, workdir):
+    results = {}
+    records = make_inventory(skus, seed=seed)
+    heap, filename = load_heap(records, workdir)
+
+    results[f"load_from_file[skus={skus}]"] = measure(
+        lambda: ProductHeap(filename=filename).load_from_file(filename), repeat)
+    ndjson = os.path.join(workdir, f"inventory_{skus}.ndjson")
+    heap.save_to_file(ndjson)
+    results[f"load_ndjson[skus={skus}]"] = measure(
+        lambda: ProductHeap(filename=ndjson).load_from_file(ndjson), repeat)
+    # cold start from the pickled heap, written by the untimed first load
+    ProductHeap(filename=filename, snapshot=True).load_from_file()
+    results[f"load_snapshot[skus={skus}]"] = measure(
+        lambda: ProductHeap(filename=filename, snapshot=True).load_from_file(), repeat)
+
+    # substrings of real names and brands, short ones hit the gram index directly
+    keywords = [r[1][:3] for r in records[::max(1, skus // SEARCH_BATCH)]][:SEARCH_BATCH // 2]
+    keywords += [r[2][1:] for r in records[::max(1, skus // SEARCH_BATCH)]][:SEARCH_BATCH // 2]
+    results[f"search_by_keyword[skus={skus}]"] = measure(
+        lambda: [heap.search_by_keyword(k) for k in keywords], repeat, ops=len(keywords))
+
+    # the same file and queries through the column store, for comparison
+    results[f"compact_load_from_file[skus={skus}]"] = measure(
+        lambda: CompactInventory(filename=filename).load_from_file(), repeat)
+    compact = CompactInventory(filename=filename)
+    compact.load_from_file()
+    results[f"compact_search_by_keyword[skus={skus}]"] = measure(
+        lambda: [compact.search_by_keyword(k) for k in keywords], repeat, ops=len(keywords))
+
+    out = os.path.join(workdir, "saved.json")
+    results[f"save_to_file[skus={skus}]"] = measure(lambda: heap.save_to_file(out), repeat)
+    return results
+
+def bench_checkout(lines, repeat, seed, workdir):
+    records = make_inventory(CHECKOUT_SKUS, seed=seed)
+    heap, _ = load_heap(records, workdir)
+    cart_file = os.path.join(workdir, "cart.json")
+
+    def fill():
+        cart = CartManager(cart_file)
+        for p, n, b, q in records[:lines]:
+            cart.cart[(n, b)] = 1
+        return cart
+
+    return {f"checkout[lines={lines}]": measure(
+        lambda cart: cart.checkout(heap, echo=False), repeat, setup=fill)}
+
+def bench_routes(rows, cols, sizes, repeat, seed, workdir):
+    results = {}
+    products = [f"p{i}" for i in range(rows * cols)]
+    layout = make_layout(rows, cols, density=0.1, products=products, seed=seed)
+    layout_file = os.path.join(workdir, f"layout_{rows}x{cols}.json")
+    # later calls hit the in-process cache, so the build is timed once
+    results[f"load_matrix[grid={rows}x{cols}]"] = measure(
+        lambda: load_matrix(layout, layout_file), 1)
+    matrix = load_matrix(layout, layout_file)
+    index = build_product_index(layout["products"])
+    for size in sizes:
+        lists = make_shopping_lists(products, ROUTE_BATCH, size, seed=seed + size)
+        racks = [racks_for_products(items, index, matrix)[0] for items in lists]
+
+        def run():
+            # the route cache would turn every repeat after the first into a lookup
+            for visit in racks:
+                find_optimal_route(None, visit, time_budget=ROUTE_TIME_BUDGET, matrix=matrix,
+                                   cache=False)
+
+        results[f"find_optimal_route[grid={rows}x{cols},racks={size}]"] = measure(
+            run, repeat, ops=len(racks))
+    return results
+
+def run_benchmarks(scale="small", repeat=DEFAULT_REPEAT, seed=0, only=None, log=print):
+    """
+    Run every benchmark of a scale and return {name: timing}. only, if
+    given, keeps benchmarks whose name starts with one of its entries.
+    """
+    config = SCALES[scale]
+    # (benchmark names a job produces, job)
+    jobs = []
+    for skus in config["skus"]:
+        jobs.append((INVENTORY_BENCHMARKS, lambda d, s=skus: bench_inventory(s, repeat, seed, d)))
+    for lines in config["cart_lines"]:
+        jobs.append((("checkout",), lambda d, n=lines: bench_checkout(n, repeat, seed, d)))
+    for rows, cols in config["grids"]:
+        jobs.append((ROUTE_BENCHMARKS, lambda d, r=rows, c=cols: bench_routes(
+            r, c, config["route_sizes"], repeat, seed, d)))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for names, job in jobs:
+            if only and not any(o.startswith(n) or n.startswith(o) for o in only for n in names):
+                continue
+            for name, timing in job(workdir).items():
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                results[name] = timing
+                log(f" {name:<55} {timing['median'] * 1000:10.3f} ms")
+    return results
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    (name, baseline median, current median, ratio) for every benchmark
+    present in both runs, and the subset slower than 1 + threshold.
+    """
+    rows = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = current["median"] / before["median"] if before["median"] else float('inf')
+        rows.append((name, before["median"], current["median"], ratio))
+    return rows, [row for row in rows if row[3] > 1 + threshold]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the shop's hot paths.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append",
+                        help="run benchmarks whose name starts with this (repeatable)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before failing, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scale, args.repeat, args.seed, args.only)
+    report = {
+        "meta": {
+            "scale": args.scale,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"\n Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        rows, regressions = compare(results, baseline, args.threshold)
+        print("\n Against baseline:")
+        for name, before, after, ratio in rows:
+            flag = "  REGRESSION" if (name, before, after, ratio) in regressions else ""
+            print(f" {name:<55} {before * 1000:10.3f} -> {after * 1000:10.3f} ms  x{ratio:.2f}{flag}")
+        if regressions:
+            print(f"\n {len(regressions)} benchmark(s) slower than the {args.threshold:.0%} threshold.")
+            return 1
+        print("\n No regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
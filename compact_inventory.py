@@ -0,0 +1,497 @@
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import metrics
+from shop_algorithms import GRAM_SIZE, PAGE_SIZE, PriceListeners, ProductHeap
+from storage import is_sqlite_path, open_storage
+
+try:
+    import numpy
+except ImportError:  # optional, only columns() uses it
+    numpy = None
+
+def _whole(quantity):
+    # the quantity column is array('q'): accept ints and integral floats only
+    if isinstance(quantity, int):
+        return quantity
+    if isinstance(quantity, float) and quantity.is_integer():
+        return int(quantity)
+    raise ValueError(f"quantity must be a whole number, got {quantity!r}")
+
+class Row:
+    """
+    Live view of one inventory record; unpacks, indexes, tests equal and
+    orders like the (price, name, brand, quantity) tuples ProductHeap
+    stores. Unhashable, as the record it shows can change.
+    """
+    __slots__ = ("_store", "_key")
+
+    def __init__(self, store, key):
+        self._store = store
+        self._key = key
+
+    def __iter__(self):
+        return iter(self._store._record(self._key))
+
+    def __getitem__(self, i):
+        return self._store._record(self._key)[i]
+
+    def __len__(self):
+        return 4
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __lt__(self, other):
+        return tuple(self) < tuple(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Row{self._store._record(self._key)!r}"
+
+class Rows:
+    """
+    Row views over a CompactInventory in storage order, standing in for
+    ProductHeap.heap where callers count or iterate records.
+    """
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store.prices)
+
+    def __getitem__(self, i):
+        return Row(self._store, self._store.row_keys[i])
+
+    def __iter__(self):
+        store = self._store
+        return (Row(store, key) for key in store.row_keys)
+
+class CompactInventory(PriceListeners):
+    """
+    Inventory with ProductHeap's API, stored column-wise: prices and
+    quantities in typed arrays, names and brands as ids into a table of
+    interned strings. A record costs a few dozen bytes against well over
+    a kilobyte for a ProductHeap tuple and its index entries.
+
+    Records are identified by key = name_id << 32 | brand_id, the ids of
+    the lowercased strings; name_ids and brand_ids hold the spellings the
+    record was stored with. Rows are dense, a delete moves the last row
+    into the hole. The keyword index covers the string table rather than
+    the records, and the price order is rebuilt on the next query after a
+    price changes; stock changes never touch it. There is no journal or
+    cross-process mode, use ProductHeap for those. Quantities are whole
+    numbers; an integral float such as 3.0 is stored as 3, anything else
+    raises ValueError.
+    """
+    def __init__(self, filename="layout_data.json", worker=None):
+        self.filename = filename
+        self.worker = worker
+        self.storage = open_storage(filename) if is_sqlite_path(filename) else None
+        self.reservations = 0
+        self.refused = 0
+        # what the last load saw on disk, see reload_if_changed
+        self._seen = None
+        # (rows iterator, signature) of a load_pages still under way, see _finish_loading
+        self._paging = None
+        # callbacks told about price changes, see on_price_change
+        self._price_listeners = []
+        # records changed since the last worker save: key -> record, None once deleted
+        self._changes = {}
+        self._clear()
+
+    def _clear(self):
+        self.prices = array('d')
+        self.quantities = array('q')
+        self.name_ids = array('i')
+        self.brand_ids = array('i')
+        self.row_keys = array('q')
+        # key -> row of that record in the columns
+        self._rows = {}
+        # string table, id -> text and text -> id: spellings and lowercase forms
+        self._strings = []
+        self._string_ids = {}
+        # trigrams -> ids of lowercased strings containing them; entries
+        # outlive the string's last record, searches skip those
+        self._grams = defaultdict(lambda: array('i'))
+        # lowercased string id -> keys of the records it names or brands, as an
+        # insertion-ordered dict so a delete drops its key in O(1)
+        self._by_string = defaultdict(dict)
+        # rows sorted by (price, key), None until a query needs it
+        self._price_order = None
+
+    @property
+    def heap(self):
+        return Rows(self)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def _intern(self, text, lower=False):
+        i = self._string_ids.get(text)
+        if i is None:
+            i = len(self._strings)
+            self._strings.append(sys.intern(text))
+            self._string_ids[text] = i
+            if lower:
+                for gram in ProductHeap._grams_of(text):
+                    self._grams[gram].append(i)
+        return i
+
+    def _key_of(self, name, brand):
+        # None when no record was ever stored under these strings
+        name_id = self._string_ids.get(name.lower())
+        brand_id = self._string_ids.get(brand.lower())
+        if name_id is None or brand_id is None:
+            return None
+        return name_id << 32 | brand_id
+
+    def _key(self, key):
+        # the lowercased (name, brand) ProductHeap keys a record by
+        return (self._strings[key >> 32], self._strings[key & 0xFFFFFFFF])
+
+    def _row_record(self, i):
+        strings = self._strings
+        return (self.prices[i], strings[self.name_ids[i]], strings[self.brand_ids[i]], self.quantities[i])
+
+    def _record(self, key):
+        return self._row_record(self._rows[key])
+
+    def _row_of(self, name, brand):
+        key = self._key_of(name, brand)
+        return None if key is None else self._rows.get(key)
+
+    def _upsert(self, record, notify=True):
+        p, n, b, q = record
+        q = _whole(q)
+        key = self._intern(n.lower(), True) << 32 | self._intern(b.lower(), True)
+        i = self._rows.get(key)
+        if i is None:
+            self._rows[key] = len(self.prices)
+            self.prices.append(p)
+            self.quantities.append(q)
+            self.name_ids.append(self._intern(n))
+            self.brand_ids.append(self._intern(b))
+            self.row_keys.append(key)
+            for string_id in {key >> 32, key & 0xFFFFFFFF}:
+                self._by_string[string_id][key] = None
+            changed = True
+        else:
+            changed = self.prices[i] != p
+            self.prices[i] = p
+            self.quantities[i] = q
+            self.name_ids[i] = self._intern(n)
+            self.brand_ids[i] = self._intern(b)
+        if changed:
+            self._price_order = None
+            if notify:
+                self._notify_price(self._key(key), p)
+        return key
+
+    def _remove(self, key):
+        i = self._rows.pop(key, None)
+        if i is None:
+            return False
+        last = len(self.prices) - 1
+        if i != last:
+            moved = self.row_keys[last]
+            self.prices[i] = self.prices[last]
+            self.quantities[i] = self.quantities[last]
+            self.name_ids[i] = self.name_ids[last]
+            self.brand_ids[i] = self.brand_ids[last]
+            self.row_keys[i] = moved
+            self._rows[moved] = i
+        for column in (self.prices, self.quantities, self.name_ids, self.brand_ids, self.row_keys):
+            del column[last]
+        for string_id in {key >> 32, key & 0xFFFFFFFF}:
+            keys = self._by_string[string_id]
+            del keys[key]
+            if not keys:
+                del self._by_string[string_id]
+        self._price_order = None
+        self._notify_price(self._key(key), None)
+        return True
+
+    def _log_put(self, key):
+        if self.storage is not None:
+            self.storage.put_item(self._record(key))
+        elif self.worker is not None:
+            self._changes[self._key(key)] = self._record(key)
+
+    def _log_del(self, name, brand):
+        if self.storage is not None:
+            self.storage.delete_item(name, brand)
+        elif self.worker is not None:
+            self._changes[ProductHeap._key(name, brand)] = None
+
+    def add_product(self, name, brand, price, quantity):
+        # adding an existing name/brand replaces that record
+        self._finish_loading()
+        key = self._upsert((price, name.lower(), brand, quantity))
+        self._log_put(key)
+
+    def update_product(self, name, brand, price=None, quantity=None):
+        self._finish_loading()
+        i = self._row_of(name, brand)
+        if i is None:
+            return False
+        p, n, b, q = self._row_record(i)
+        key = self._upsert((
+            price if price is not None else p,
+            n,
+            b,
+            quantity if quantity is not None else q
+        ))
+        self._log_put(key)
+        return True
+
+    def delete_product(self, name, brand):
+        self._finish_loading()
+        key = self._key_of(name, brand)
+        if key is not None and self._remove(key):
+            self._log_del(name, brand)
+
+    def get(self, name, brand):
+        """
+        The (price, name, brand, quantity) record for name/brand, or None.
+        """
+        i = self._row_of(name, brand)
+        return None if i is None else self._row_record(i)
+
+    def price(self, name, brand):
+        i = self._row_of(name, brand)
+        return None if i is None else self.prices[i]
+
+    def stock(self, name, brand):
+        i = self._row_of(name, brand)
+        return None if i is None else self.quantities[i]
+
+    @metrics.timed("update_quantity")
+    def update_quantity(self, name, brand, qty_change):
+        self._finish_loading()
+        i = self._row_of(name, brand)
+        if i is None:
+            return False
+        self.quantities[i] += _whole(qty_change)
+        self._log_put(self.row_keys[i])
+        return True
+
+    @metrics.timed("reserve")
+    def reserve(self, name, brand, qty_change):
+        """
+        Change the stock of name/brand by qty_change unless that would take
+        it below zero. Returns False, changing nothing, for an unknown
+        product or not enough stock.
+        """
+        qty_change = _whole(qty_change)
+        self._finish_loading()
+        i = self._row_of(name, brand)
+        if i is None or self.quantities[i] + qty_change < 0:
+            self.refused += 1
+            return False
+        self.reservations += 1
+        return self.update_quantity(name, brand, qty_change)
+
+    def reservation_stats(self):
+        return {
+            "reservations": self.reservations,
+            "refused": self.refused,
+            "cas_retries": 0,
+            "lock_wait_total": 0.0,
+            "lock_wait_max": 0.0,
+            "lock_wait_avg": 0.0,
+        }
+
+    @metrics.timed("search_by_keyword")
+    def search_by_keyword(self, keyword):
+        keyword = keyword.lower()
+        if not keyword:
+            return sorted(map(self._row_record, range(len(self.prices))), key=lambda x: x[0])
+        if len(keyword) < GRAM_SIZE:
+            # too short for a trigram: scan the string table
+            matches = [i for i, text in enumerate(self._strings) if keyword in text]
+        else:
+            postings = sorted(
+                (self._grams.get(keyword[i:i + GRAM_SIZE], ())
+                 for i in range(len(keyword) - GRAM_SIZE + 1)),
+                key=len
+            )
+            matches = set(postings[0]).intersection(*postings[1:])
+            matches = [s for s in matches if keyword in self._strings[s]]
+        keys = set()
+        for string_id in matches:
+            keys.update(self._by_string.get(string_id, ()))
+        return sorted(map(self._record, keys), key=lambda x: x[0])
+
+    def _order(self):
+        # row numbers sorted by (price, key), the order of ProductHeap's price index
+        if self._price_order is None:
+            prices, row_keys, key = self.prices, self.row_keys, self._key
+            self._price_order = array('q', sorted(
+                range(len(prices)), key=lambda i: (prices[i], key(row_keys[i]))))
+        return self._price_order
+
+    def brands_by_price(self, name, k=None):
+        """
+        Records of product name, cheapest brand first; only the k cheapest
+        when k is given.
+        """
+        name_id = self._string_ids.get(name.lower())
+        if name_id is None:
+            return []
+        keys = sorted(
+            (key for key in self._by_string.get(name_id, ()) if key >> 32 == name_id),
+            key=lambda key: (self.prices[self._rows[key]], self._strings[key & 0xFFFFFFFF])
+        )
+        if k is not None:
+            keys = keys[:k]
+        return [self._record(key) for key in keys]
+
+    def cheapest(self, k):
+        """
+        The k cheapest records across every product.
+        """
+        return [self._row_record(i) for i in self._order()[:k]]
+
+    def in_price_range(self, low, high):
+        """
+        Records priced from low to high inclusive, cheapest first.
+        """
+        order, prices = self._order(), self.prices
+        start = bisect_left(order, low, key=prices.__getitem__)
+        end = bisect_right(order, high, key=prices.__getitem__)
+        return [self._row_record(i) for i in order[start:end]]
+
+    def show_all_grouped(self):
+        grouped = defaultdict(list)
+        names = {key >> 32 for key in self._rows}
+        for name_id in sorted(names, key=self._strings.__getitem__):
+            for p, n, b, q in self.brands_by_price(self._strings[name_id]):
+                grouped[n].append((b, p, q))
+        return grouped
+
+    def columns(self):
+        """
+        Price and quantity columns for vectorised scans, e.g.
+        (cols["price"] * cols["quantity"]).sum() for the stock value.
+        NumPy arrays sharing the store's memory when NumPy is installed,
+        else the arrays themselves; drop NumPy views before adding or
+        deleting records, as the arrays cannot resize while viewed.
+        """
+        if numpy is None:
+            return {"price": self.prices, "quantity": self.quantities}
+        return {
+            "price": numpy.frombuffer(self.prices, dtype=numpy.float64),
+            "quantity": numpy.frombuffer(self.quantities, dtype=numpy.int64),
+        }
+
+    def _records(self):
+        return map(self._row_record, range(len(self.prices)))
+
+    def _attach(self, filename):
+        self.filename = filename
+        self.storage = open_storage(filename) if is_sqlite_path(filename) else None
+
+    @metrics.timed("inventory_save")
+    def save_to_file(self, filename=None):
+        # default to the file this store is attached to
+        if filename is None:
+            filename = self.filename
+        self._finish_loading()
+        metrics.set_gauge("product_heap_size", len(self.prices))
+        if filename != self.filename:
+            # a copy elsewhere: every record goes there, the store stays on its own file
+            if is_sqlite_path(filename):
+                open_storage(filename).save_inventory(self._records())
+            else:
+                ProductHeap._write_inventory((filename, self._records()))
+            return
+        if self.storage is not None:
+            # rows were written as they changed, make them durable
+            self.storage.commit()
+            return
+        if self.worker is not None:
+            # only the records changed since the last save go to the worker
+            changes, self._changes = self._changes, {}
+            self.worker.submit(("inventory", filename), ProductHeap._write_changes,
+                               (filename, changes), merge=ProductHeap._merge_changes)
+            return
+        ProductHeap._write_inventory((filename, self._records()))
+
+    def _signature(self):
+        if self.storage is not None:
+            return self.storage.data_version()
+        return ProductHeap._signature(self.filename)
+
+    @metrics.timed("inventory_load")
+    def load_from_file(self, filename=None):
+        for _ in self.load_pages(filename, page_size=None):
+            pass
+
+    def load_pages(self, filename=None, page_size=PAGE_SIZE):
+        """
+        Load the inventory page_size records at a time (all at once for
+        None), yielding the number loaded so far after each page; queries
+        between pages see the records loaded up to then.
+        """
+        if filename is None:
+            filename = self.filename
+        if filename != self.filename:
+            self._attach(filename)
+        seen = self._signature()
+        if self.storage is not None:
+            rows = self.storage.load_inventory()
+        else:
+            try:
+                rows = ProductHeap._file_rows(filename)
+            except FileNotFoundError:
+                return
+        # reset the columns to avoid duplications on multiple loads
+        self._clear()
+        rows = iter(rows)
+        self._paging = (rows, seen)
+        # records taken in at the last yield; _finish_loading may add the rest
+        loaded = None
+        for count, record in enumerate(rows, 1):
+            self._upsert(record, notify=False)
+            if page_size and count % page_size == 0:
+                self._notify_price(None, None)
+                loaded = len(self.prices)
+                yield loaded
+        if self._paging is not None:
+            self._paging = None
+            self._seen = seen
+            metrics.set_gauge("product_heap_size", len(self.prices))
+            self._notify_price(None, None)
+        if loaded is None or loaded != len(self.prices):
+            yield len(self.prices)
+
+    def _finish_loading(self):
+        # see ProductHeap._finish_loading: take in the rest of a paged load
+        # before a change or a save, the suspended load_pages then ends
+        if self._paging is None:
+            return
+        rows, seen = self._paging
+        self._paging = None
+        for record in rows:
+            self._upsert(record, notify=False)
+        self._seen = seen
+        metrics.set_gauge("product_heap_size", len(self.prices))
+        self._notify_price(None, None)
+
+    def reload_if_changed(self, filename=None):
+        """
+        Reload when the source moved since the last load. Returns the
+        number of records loaded, and 0 without reading anything when
+        nothing changed.
+        """
+        if filename is None:
+            filename = self.filename
+        if filename == self.filename and self._seen is not None and self._signature() == self._seen:
+            return 0
+        self.load_from_file(filename)
+        return len(self.prices)
@@ -1,19 +1,34 @@
 from shop_algorithms import ProductHeap, CartManager
 from addproductList import get_customer_product_list
-from customer_route import build_graph, find_optimal_route
-import json
-import heapq
-import importlib
-import runpy
-import subprocess
+from storage import LAYOUT_FILE, CART_FILE, open_storage
 import sys
 import os
 
-products_heap = ProductHeap()
-products_heap.load_from_file("layout_data.json")
-cart_mgr = CartManager()
+# inventory and cart, built on first use so importing this module stays
+# cheap for callers that never open the customer menu
+_state = {}
+
+def _session():
+    """
+    The (products_heap, cart_mgr) pair, loading both the first time.
+    """
+    if not _state:
+        # shared: other tills may run against the same inventory
+        products_heap = ProductHeap(journal=True, filename=LAYOUT_FILE, shared=True, snapshot=True)
+        products_heap.load_from_file(LAYOUT_FILE)
+        _state["products_heap"] = products_heap
+        _state["cart_mgr"] = CartManager(CART_FILE, journal=True)
+    return _state["products_heap"], _state["cart_mgr"]
+
+def __getattr__(name):
+    # customer.products_heap and customer.cart_mgr load on first access
+    if name in ("products_heap", "cart_mgr"):
+        _session()
+        return _state[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def show_products():
+    products_heap, cart_mgr = _session()
     grouped = products_heap.show_all_grouped()
     if not grouped:
         print("No products available.")
@@ -23,16 +38,12 @@ def show_products():
     for product_name in sorted(grouped.keys()):
         print(f"\nProduct Name: {product_name.title()}")
         print("Brands (sorted by price):")
-        brand_heap = []
-        for brand, price, qty in grouped[product_name]:
-            heapq.heappush(brand_heap, (price, brand, qty))
-        index = 1
-        while brand_heap:
-            price, brand, qty = heapq.heappop(brand_heap)
+        # show_all_grouped lists each product's brands cheapest first
+        for index, (brand, price, qty) in enumerate(grouped[product_name], start=1):
             print(f"   {index}. {brand} — Rs {price:.2f} (Stock: {qty})")
-            index += 1
 
 def search_products():
+    products_heap, cart_mgr = _session()
     while True:
         kw = input("\n Enter product keyword to search (or '0' to finish): ").strip()
         if kw == "0":
@@ -42,6 +53,7 @@ def search_products():
         if not results:
             print(" No matching products.")
             continue
+        # results come cheapest first, so each group stays in price order
         grouped = {}
         for price, name, brand, qty in results:
             grouped.setdefault(name.lower(), []).append((brand, price, qty))
@@ -49,16 +61,11 @@ def search_products():
         for product_name in sorted(grouped.keys()):
             print(f"\nProduct Name: {product_name.title()}")
             print("Brands (sorted by price):")
-            brand_heap = []
-            for brand, price, qty in grouped[product_name]:
-                heapq.heappush(brand_heap, (price, brand, qty))
-            index = 1
-            while brand_heap:
-                price, brand, qty = heapq.heappop(brand_heap)
+            for index, (brand, price, qty) in enumerate(grouped[product_name], start=1):
                 print(f"   {index}. {brand} — Rs {price:.2f} (Stock: {qty})")
-                index += 1
 
 def add_to_cart():
+    products_heap, cart_mgr = _session()
     while True:
         keyword = input("\nEnter search keyword (or '0' to finish): ").strip()
         if keyword == "0":
@@ -68,20 +75,16 @@ def add_to_cart():
         if not results:
             print(" No matching products found.")
             continue
+        # results come cheapest first, so each group stays in price order
         grouped = {}
         for price, name, brand, qty in results:
-            grouped.setdefault(name.lower(), []).append((brand, price, qty))
+            grouped.setdefault(name.lower(), []).append((price, brand, qty))
         for product_name in sorted(grouped.keys()):
             print(f"\n Products:\n\nProduct Name: {product_name.title()}")
             print("Brands (sorted by price):")
-            brand_heap = []
-            for brand, price, qty in grouped[product_name]:
-                heapq.heappush(brand_heap, (price, brand, qty))
-            sorted_brands = []
-            while brand_heap:
-                price, brand, qty = heapq.heappop(brand_heap)
-                sorted_brands.append((price, brand, qty))
-                print(f"   {len(sorted_brands)}. {brand} — Rs {price:.2f} (Stock: {qty})")
+            sorted_brands = grouped[product_name]
+            for index, (price, brand, qty) in enumerate(sorted_brands, start=1):
+                print(f"   {index}. {brand} — Rs {price:.2f} (Stock: {qty})")
             selected_indices = set()
             while True:
                 try:
@@ -107,36 +110,21 @@ def add_to_cart():
                         print(" Could not add to cart.")
                 except ValueError:
                     print(" Invalid input. Try again.")
-                    
-import heapq  
+
 
 def view_cart():
+    products_heap, cart_mgr = _session()
     if not cart_mgr.cart:
         print("\n Cart is empty.")
         return
 
-    # 1. Build a flat list of all items with their computed subtotals
-    items = []
-    for (name, brand), qty in cart_mgr.cart.items():
-        price = next(
-            (p for p, n, b, _ in products_heap.heap
-             if n == name and b == brand),
-            None
-        )
-        if price is None:
-            continue
-        subtotal = price * qty
-        items.append((subtotal, name, brand, qty, price))
-
-    # 2. Sort items by subtotal (lowest first)
-    items.sort(key=lambda x: x[0])
+    # 1. Cart lines with their running subtotals, lowest first
+    items, total = cart_mgr.bill(products_heap)
 
-    # 3. Print in the flat 
+    # 2. Print in the flat 
     print("\n Current Cart:")
-    total = 0.0
     for subtotal, name, brand, qty, price in items:
         print(f"          {name.title()} - {brand} x {qty} @ Rs {price:.2f} = Rs {subtotal:.2f}")
-        total += subtotal
 
     print(f"\nTotal Bill :- Rs {total:.2f}")
 
@@ -145,32 +133,25 @@ def view_cart():
 def display_cart_with_indices(products_heap, cart_mgr):
     index_map = {}
     grouped_cart = {}
-    for (name, brand), qty in cart_mgr.cart.items():
-        price = next((p for p, n, b, _ in products_heap.heap if n == name and b == brand), None)
-        if price is not None:
-            subtotal = price * qty
-            grouped_cart.setdefault(name.lower(), []).append((subtotal, price, brand, qty))
+    items, total = cart_mgr.bill(products_heap)
+    for subtotal, name, brand, qty, price in items:
+        grouped_cart.setdefault(name.lower(), []).append((subtotal, price, brand, qty))
 
     print("\n Current Cart:")
-    total = 0
     global_index = 1
     for product_name in sorted(grouped_cart.keys()):
         print(f"\nProduct Name:- {product_name.title()}")
-        brand_heap = []
+        # bill() already lists lines by subtotal, lowest first
         for subtotal, price, brand, qty in grouped_cart[product_name]:
-            heapq.heappush(brand_heap, (subtotal, price, brand, qty))
-
-        while brand_heap:
-            subtotal, price, brand, qty = heapq.heappop(brand_heap)
             print(f"   {global_index}. {brand} x {qty} @ RS {price:.2f} = Rs {subtotal:.2f}")
             index_map[global_index] = (product_name, brand)
-            total += subtotal
             global_index += 1
 
     print(f"\nTotal Bill :- Rs {total:.2f}")
     return index_map
 
 def cart_action_menu():
+    products_heap, cart_mgr = _session()
     while True:
         print("\n Cart Actions:")
         print("1.  Update cart item")
@@ -225,9 +206,10 @@ def cart_action_menu():
 
 
 def customer_menu():
+    products_heap, cart_mgr = _session()
     while True:
-        # refresh products from disk 
-        products_heap.load_from_file("layout_data.json")
+        # pick up admin changes from disk, a no-op when nothing was written
+        products_heap.reload_if_changed(LAYOUT_FILE)
         print("\n--- Customer Menu ---")
         print("1.  Add product list")
         print("2.  View products")
@@ -245,37 +227,27 @@ def customer_menu():
 
             # compute and show route based on layout_data.json using customer_route functions
             if shopping_list:
+                from customer_route import find_optimal_route, racks_for_products
+                from distance_matrix import load_matrix, load_product_index
                 try:
-                    with open("layout_data.json", "r") as f:
-                        layout = json.load(f)
-                    distance_map = layout.get("distances", {})
-                    product_map = layout.get("products", {})
-                    rack_ids = layout.get("rack_ids", [])
-
-                    graph = build_graph(distance_map)
-                    for node in rack_ids:
-                        graph.setdefault(node, [])
-
-                    racks_to_visit = []
-                    missing = []
-                    for product in shopping_list:
-                        found = False
-                        for rack, item in product_map.items():
-                            if item.strip().lower() == product.strip().lower():
-                                racks_to_visit.append(rack)
-                                found = True
-                                break
-                        if not found:
-                            missing.append(product)
+                    layout = open_storage(LAYOUT_FILE).load_layout()
+                    matrix = load_matrix(layout, LAYOUT_FILE)
+
+                    racks_to_visit, missing = racks_for_products(
+                        shopping_list, load_product_index(layout, matrix), matrix)
 
                     if missing:
                         for m in missing:
                             print(f" Product '{m}' not found in layout.")
 
                     if racks_to_visit:
-                        route, total_distance = find_optimal_route(graph, racks_to_visit)
+                        route, total_distance, exact = find_optimal_route(
+                            None, racks_to_visit, with_status=True, matrix=matrix)
                         if route:
-                            print("\n Optimal route to follow:")
+                            if exact:
+                                print("\n Optimal route to follow:")
+                            else:
+                                print("\n Suggested route to follow (approximate):")
                             print(" -> ".join(route))
                             print(f" Total distance: {total_distance:.2f} units")
                         else:
@@ -289,23 +261,18 @@ def customer_menu():
 
             #  adding items from shopping_list to cart
             for keyword in shopping_list:
-                results = products_heap.search_by_keyword(keyword)
-                if not results:
-                    print(f"\n No match for '{keyword}'")
-                    continue
-                brand_heap = []
-                for price, name, brand, qty in results:
-                    if name.lower() == keyword.lower():
-                        heapq.heappush(brand_heap, (price, brand, qty))
-                if not brand_heap:
-                    print(f"\n No exact match for '{keyword}'")
+                sorted_brands = [
+                    (price, brand, qty)
+                    for price, name, brand, qty in products_heap.brands_by_price(keyword)
+                ]
+                if not sorted_brands:
+                    if products_heap.search_by_keyword(keyword):
+                        print(f"\n No exact match for '{keyword}'")
+                    else:
+                        print(f"\n No match for '{keyword}'")
                     continue
                 print(f"\nProduct Name: {keyword.title()}")
                 print("    Brands (sorted by price):")
-                sorted_brands = []
-                while brand_heap:
-                    price, brand, qty = heapq.heappop(brand_heap)
-                    sorted_brands.append((price, brand, qty))
                 for i, (price, brand, qty) in enumerate(sorted_brands, start=1):
                     print(f"       {i}. {brand} — Rs {price:.2f} (Stock: {qty})")
                 selected_indices = set()
@@ -346,6 +313,9 @@ def customer_menu():
             cart_mgr.checkout(products_heap)
         elif choice == "7":
             # Try to run reroute_to_r1 in several ways 
+            import importlib
+            import runpy
+            import subprocess
             try:
                 # Try importing as a module and calling main()
                 mod = importlib.import_module("reroute_to_r1")
@@ -1,39 +1,168 @@
+import atexit
 import json
-import heapq
-import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import metrics
+from graph_core import Graph
+from storage import LAYOUT_FILE, on_layout_saved, open_storage
 
-def build_graph(distance_map):
-    graph = {}
-    for key, value in distance_map.items():
-        if "->" not in key:
-            continue
-        a, b = key.split("->", 1)
-        graph.setdefault(a, [])
-        graph.setdefault(b, [])  # ensure target node exists in graph
-        weight = float('inf') if str(value) == "∞" else float(value)
-        if weight != float('inf'):
-            graph[a].append((b, weight))
-    return graph
+# above this many distinct racks find_optimal_route switches to the heuristic
+EXACT_RACK_LIMIT = 15
+# wall-clock seconds the heuristic may spend improving a route
+HEURISTIC_TIME_BUDGET = 1.0
+
+# routes find_optimal_route keeps for repeated baskets
+ROUTE_CACHE_SIZE = 1024
+# SHOP_ROUTE_CACHE_FILE names a JSON file the route cache is read from on its
+# first lookup and written back to when the main process exits
+ROUTE_CACHE_FILE = os.environ.get("SHOP_ROUTE_CACHE_FILE")
+
+# per-process state of plan_routes workers, set once by _init_batch_worker
+_batch = {}
+
+class RouteCache:
+    """
+    Least-recently-used map of solved routes. A key is the layout version,
+    the start rack, the other racks sorted and whether the exact solver
+    applies, so the same basket listed in any order shares one entry and
+    a layout with new distances never sees routes from the old one.
+    """
+    def __init__(self, size=ROUTE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # file to load on the first lookup and whether anything was put since, see persist
+        self._pending_load = None
+        self._changed = False
+
+    @staticmethod
+    def key(version, racks, exact):
+        return (version, racks[0], tuple(sorted(racks[1:])), exact)
+
+    def get(self, key):
+        """
+        The cached (route, distance, exact) for key, or None.
+        """
+        if self._pending_load is not None:
+            with self._lock:
+                filename, self._pending_load = self._pending_load, None
+            if filename is not None:
+                self.load(filename, version=key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.add("route_cache_misses" if entry is None else "route_cache_hits")
+        return entry
+
+    def put(self, key, entry):
+        evicted = 0
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._changed = True
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.add("route_cache_evictions", evicted)
+
+    def clear(self, *args):
+        # also the on_layout_saved listener, which passes the layout path
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def save(self, filename):
+        """
+        Write the entries, least recently used first, through a temporary file.
+        """
+        with self._lock:
+            entries = [list(key[:2]) + [list(key[2]), key[3], list(entry)]
+                       for key, entry in self._entries.items()]
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, filename)
+
+    def load(self, filename, version=None):
+        """
+        Add the entries saved in filename, only those for layout version
+        when given; a missing or unreadable file adds nothing.
+        """
+        try:
+            with open(filename, "r") as f:
+                entries = json.load(f)
+            for saved, start, rest, exact, (route, distance, route_exact) in entries:
+                if version is None or saved == version:
+                    self.put((saved, start, tuple(rest), exact), (route, distance, route_exact))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def persist(self, filename):
+        """
+        Load filename on the first lookup, keeping only routes for the layout
+        version being looked up, and save back to it at exit. Only the main
+        process saves: pool workers import this module too, and their
+        partial caches would overwrite each other's and the parent's.
+        """
+        self._pending_load = filename
+        if multiprocessing.parent_process() is None:
+            atexit.register(self._save_at_exit, filename)
+
+    def _save_at_exit(self, filename):
+        # a process that never routed would only write back an empty cache
+        if not self._changed:
+            return
+        try:
+            self.save(filename)
+        except OSError as e:
+            print(f" Could not save the route cache: {e}")
+
+route_cache = RouteCache()
+# a layout saved in this process may change distances: drop every route
+on_layout_saved(route_cache.clear)
+if ROUTE_CACHE_FILE:
+    route_cache.persist(ROUTE_CACHE_FILE)
+
+def build_graph(distance_map, rack_ids=()):
+    return Graph.from_distances(distance_map, rack_ids)
 
 def dijkstra(graph, start):
-    distances = {node: float('inf') for node in graph}
-    predecessors = {}
-    if start not in distances:
-        return distances, predecessors
-    distances[start] = 0
-    queue = [(0, start)]
-
-    while queue:
-        cost, node = heapq.heappop(queue)
-        if cost > distances.get(node, float('inf')):
-            continue
-        for neighbor, weight in graph.get(node, []):
-            new_cost = cost + weight
-            if new_cost < distances.get(neighbor, float('inf')):
-                distances[neighbor] = new_cost
-                predecessors[neighbor] = node
-                heapq.heappush(queue, (new_cost, neighbor))
-    return distances, predecessors
+    """
+    Shortest distances and predecessors from start, keyed by rack id.
+    """
+    if start not in graph:
+        return {node: float('inf') for node in graph}, {}
+    dist, pred = graph.dijkstra(graph.index[start])
+    nodes = graph.nodes
+    predecessors = {nodes[v]: nodes[u] for v, u in enumerate(pred) if u != -1}
+    return dict(zip(nodes, dist)), predecessors
 
 def reconstruct_path(predecessors, start, end):
     path = []
@@ -46,66 +175,332 @@ def reconstruct_path(predecessors, start, end):
     path.append(start)
     return list(reversed(path))
 
-def find_optimal_route(graph, racks):
+@metrics.timed("route_exact_solve")
+def held_karp(all_distances, sequence):
+    """
+    Exact bitmask DP over visiting orders with sequence[0] fixed as start.
+    Returns (best_order, cost); best_order is [] when no valid order exists.
+    """
+    start, others = sequence[0], sequence[1:]
+    m = len(others)
+    if m == 0:
+        return [start], 0.0
+    inf = float('inf')
+    # dist[k][j] from others[k] to others[j], first[j] from start to others[j]
+    first = [all_distances[start].get(r, inf) for r in others]
+    dist = [[all_distances[a].get(b, inf) for b in others] for a in others]
+
+    full = (1 << m) - 1
+    # dp[mask][j]: cheapest path from start through mask ending at others[j]
+    dp = [None] * (full + 1)
+    bits_of = [()] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        bits = bits_of[mask ^ low] + (low.bit_length() - 1,)
+        bits_of[mask] = bits
+        row = [inf] * m
+        if mask == low:
+            row[bits[0]] = first[bits[0]]
+        else:
+            for j in bits:
+                prev = dp[mask ^ (1 << j)]
+                best = inf
+                for k in bits_of[mask ^ (1 << j)]:
+                    c = prev[k] + dist[k][j]
+                    if c < best:
+                        best = c
+                row[j] = best
+        dp[mask] = row
+
+    min_distance = min(dp[full])
+    if min_distance == inf:
+        return [], inf
+
+    # walk back through the table to recover the order
+    order = []
+    mask = full
+    j = dp[full].index(min_distance)
+    while True:
+        order.append(others[j])
+        prev_mask = mask ^ (1 << j)
+        if not prev_mask:
+            break
+        prev = dp[prev_mask]
+        j = min(bits_of[prev_mask], key=lambda k: prev[k] + dist[k][j])
+        mask = prev_mask
+    order.append(start)
+    order.reverse()
+    return order, min_distance
+
+def _order_cost(dist, order):
+    return sum(dist[order[i]][order[i + 1]] for i in range(len(order) - 1))
+
+@metrics.timed("route_heuristic_solve")
+def heuristic_order(all_distances, sequence, time_budget=HEURISTIC_TIME_BUDGET):
+    """
+    Nearest-neighbour construction improved by 2-opt and Or-opt moves.
+    Stops when no move helps or time_budget seconds have passed and returns
+    the best (order, cost) found so far, with sequence[0] kept as start.
+    """
+    deadline = time.perf_counter() + time_budget
+    inf = float('inf')
+    n = len(sequence)
+    dist = [[all_distances[a].get(b, inf) for b in sequence] for a in sequence]
+
+    # nearest neighbour from the fixed start
+    order = [0]
+    remaining = set(range(1, n))
+    while remaining:
+        row = dist[order[-1]]
+        nxt = min(remaining, key=lambda k: (row[k], k))
+        order.append(nxt)
+        remaining.discard(nxt)
+
+    def d(a, b):
+        # the open path has no edge after its last stop
+        return 0.0 if b is None else dist[a][b]
+
+    best_order, best_cost = list(order), _order_cost(dist, order)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # 2-opt: reverse order[i..j], start stays in place. Directed layouts
+        # make the reversed run cost something else, so both directions of
+        # it are summed as j grows
+        for i in range(1, n - 1):
+            if time.perf_counter() >= deadline:
+                break
+            a = order[i - 1]
+            forward = backward = 0.0
+            for j in range(i + 1, n):
+                forward += dist[order[j - 1]][order[j]]
+                backward += dist[order[j]][order[j - 1]]
+                c = order[j + 1] if j + 1 < n else None
+                delta = (dist[a][order[j]] + backward + d(order[i], c)
+                         - dist[a][order[i]] - forward - d(order[j], c))
+                if delta < -1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+                    # the running sums describe the old order, move on
+                    break
+
+        # Or-opt: move runs of 1-3 stops to a cheaper gap
+        for length in (1, 2, 3):
+            i = 1
+            while i + length <= n:
+                if time.perf_counter() >= deadline:
+                    break
+                seg = order[i:i + length]
+                prev = order[i - 1]
+                after = order[i + length] if i + length < n else None
+                removed = (dist[prev][seg[0]] + d(seg[-1], after)
+                           - d(prev, after))
+                rest = order[:i] + order[i + length:]
+                best_gain, best_pos = 1e-9, None
+                for p in range(len(rest)):
+                    x = rest[p]
+                    y = rest[p + 1] if p + 1 < len(rest) else None
+                    added = dist[x][seg[0]] + d(seg[-1], y) - d(x, y)
+                    if removed - added > best_gain:
+                        best_gain, best_pos = removed - added, p
+                if best_pos is not None:
+                    order = rest[:best_pos + 1] + seg + rest[best_pos + 1:]
+                    improved = True
+                i += 1
+
+        cost = _order_cost(dist, order)
+        if cost < best_cost:
+            best_order, best_cost = list(order), cost
+
+    if best_cost == inf:
+        return [], inf
+    return [sequence[k] for k in best_order], best_cost
+
+@metrics.timed("find_optimal_route")
+def find_optimal_route(graph, racks, exact_limit=EXACT_RACK_LIMIT,
+                       time_budget=HEURISTIC_TIME_BUDGET, with_status=False,
+                       matrix=None, cache=True):
+    """
+    Shortest walk from racks[0] through every rack in racks.
+    Up to exact_limit distinct racks the order is optimal, above it the
+    heuristic engine improves the route for at most time_budget seconds. Returns
+    (full_route, distance), plus an is_exact flag when with_status is set.
+    When a DistanceMatrix is given, graph is not searched at all, and unless
+    cache is False the result comes from and goes to route_cache; a cached
+    heuristic route is reused whatever time_budget the caller passes.
+    """
     if not racks:
-        return [], 0.0
+        return ([], 0.0, True) if with_status else ([], 0.0)
+    # visiting a rack twice never shortens the walk, keep first occurrence
+    racks = list(dict.fromkeys(racks))
+
+    key = entry = None
+    if cache and matrix is not None:
+        key = RouteCache.key(matrix.version, racks, len(racks) <= exact_limit)
+        entry = route_cache.get(key)
+    if entry is None:
+        entry = _solve_route(graph, racks, exact_limit, time_budget, matrix)
+        if key is not None:
+            route_cache.put(key, entry)
+    full_route, min_distance, exact = entry
+    # callers may extend the route they get, the cached one stays intact
+    full_route = list(full_route)
+    if with_status:
+        return full_route, min_distance, exact
+    return full_route, min_distance
+
+def _solve_route(graph, racks, exact_limit, time_budget, matrix):
+    # (full_route, distance, exact) for distinct racks, see find_optimal_route
     # precompute shortest paths and predecessors
     all_distances = {}
     all_predecessors = {}
-    for rack in racks:
-        dist, preds = dijkstra(graph, rack)
-        all_distances[rack] = dist
-        all_predecessors[rack] = preds
-
-    min_distance = float('inf')
-    best_sequence = []
-
-    # try permutations fix first rack as start
-    start = racks[0]
-    for perm in itertools.permutations(racks[1:]):
-        sequence = [start] + list(perm)
-        total = 0
-        valid = True
-        for i in range(len(sequence) - 1):
-            d = all_distances[sequence[i]].get(sequence[i + 1], float('inf'))
-            if d == float('inf'):
-                valid = False
-                break
-            total += d
-        if valid and total < min_distance:
-            min_distance = total
-            best_sequence = sequence
+    if matrix is not None:
+        for rack in racks:
+            all_distances[rack] = {other: matrix.distance(rack, other) for other in racks}
+    else:
+        ids = [graph.index.get(rack) for rack in racks]
+        for rack, i in zip(racks, ids):
+            if i is None:
+                all_distances[rack] = {}
+                continue
+            dist, pred = graph.dijkstra(i)
+            all_distances[rack] = {
+                other: dist[j] for other, j in zip(racks, ids) if j is not None
+            }
+            all_predecessors[rack] = pred
+
+    # fix first rack as start and solve the visiting order
+    exact = len(racks) <= exact_limit
+    if exact:
+        best_sequence, min_distance = held_karp(all_distances, racks)
+    else:
+        best_sequence, min_distance = heuristic_order(all_distances, racks, time_budget)
 
     if not best_sequence:
-        return [], float('inf')
+        return [], float('inf'), exact
 
     # build full route with intermediate nodes using predecessors
     full_route = [best_sequence[0]]
     for i in range(len(best_sequence) - 1):
-        preds = all_predecessors[best_sequence[i]]
-        hop = reconstruct_path(preds, best_sequence[i], best_sequence[i + 1])
+        if matrix is not None:
+            hop = matrix.path(best_sequence[i], best_sequence[i + 1])
+        else:
+            hop = [graph.nodes[k] for k in graph.path_ids(
+                all_predecessors[best_sequence[i]],
+                graph.index[best_sequence[i]], graph.index[best_sequence[i + 1]])]
         if not hop:
             # fallback to direct next rack if reconstruct fails
             full_route.append(best_sequence[i + 1])
         else:
             full_route.extend(hop[1:])  # skip duplicate
-    return full_route, min_distance
+    return full_route, min_distance, exact
+
+def normalise_product(name):
+    return str(name).strip().lower()
+
+def build_product_index(product_map):
+    """
+    Reverse of the layout's rack -> products map: normalised product name ->
+    racks holding it, in layout order. A rack may list one product or many.
+    """
+    index = {}
+    for rack, items in product_map.items():
+        if not isinstance(items, list):
+            items = [items]
+        for item in items:
+            product = normalise_product(item)
+            if product and product != "unassigned":
+                index.setdefault(product, {})[rack] = None
+    return {product: list(racks) for product, racks in index.items()}
+
+def racks_for_products(shopping_list, product_index, matrix=None):
+    """
+    Pick one rack per product. A product stocked on several racks goes to a
+    rack already on the route if possible, else to the candidate nearest the
+    racks chosen so far. Returns (racks_to_visit, missing_products).
+    """
+    racks_to_visit = []
+    missing = []
+    for product in shopping_list:
+        candidates = product_index.get(normalise_product(product))
+        if not candidates:
+            missing.append(product)
+            continue
+        chosen = next((r for r in candidates if r in racks_to_visit), None)
+        if chosen is None:
+            chosen = candidates[0]
+            if matrix is not None and racks_to_visit and len(candidates) > 1:
+                chosen = min(candidates, key=lambda r: min(
+                    matrix.distance(v, r) for v in racks_to_visit))
+        racks_to_visit.append(chosen)
+    return racks_to_visit, missing
+
+def plan_order(shopping_list, product_index, matrix,
+               exact_limit=EXACT_RACK_LIMIT, time_budget=HEURISTIC_TIME_BUDGET):
+    """
+    Route for one shopping list against a distance matrix, as a dict with
+    route, distance, exact, missing and the seconds it took to solve.
+    """
+    started = time.perf_counter()
+    racks, missing = racks_for_products(shopping_list, product_index, matrix)
+    route, distance, exact = find_optimal_route(
+        None, racks, exact_limit, time_budget, with_status=True, matrix=matrix)
+    return {
+        "route": route,
+        "distance": distance,
+        "exact": exact,
+        "missing": missing,
+        "seconds": time.perf_counter() - started,
+    }
+
+def _init_batch_worker(product_index, matrix, exact_limit, time_budget):
+    # runs once per worker: the matrix crosses the process boundary here only
+    _batch.update(product_index=product_index, matrix=matrix,
+                  exact_limit=exact_limit, time_budget=time_budget)
+
+def _plan_batch_order(order_id, shopping_list):
+    return order_id, plan_order(shopping_list, **_batch)
+
+def plan_routes(orders, layout, layout_file=LAYOUT_FILE, workers=None,
+                exact_limit=EXACT_RACK_LIMIT, time_budget=HEURISTIC_TIME_BUDGET):
+    """
+    Plan routes for many orders over a process pool. orders maps order id
+    to shopping list (a plain list is numbered from 0). Each worker receives
+    the layout's distance matrix once, at start-up, and tasks carry only the
+    shopping list. Yields (order_id, result) in completion order, result
+    being plan_order's dict; workers=1 solves in this process.
+    """
+    from distance_matrix import load_matrix, load_product_index
+    matrix = load_matrix(layout, layout_file)
+    product_index = load_product_index(layout, matrix)
+    items = list(orders.items() if isinstance(orders, dict) else enumerate(orders))
+    if workers is None:
+        workers = min(len(items), os.cpu_count() or 1)
+    if workers <= 1:
+        for order_id, shopping_list in items:
+            yield order_id, plan_order(
+                shopping_list, product_index, matrix, exact_limit, time_budget)
+        return
+
+    with ProcessPoolExecutor(
+            workers, initializer=_init_batch_worker,
+            initargs=(product_index, matrix, exact_limit, time_budget)) as pool:
+        futures = [pool.submit(_plan_batch_order, order_id, shopping_list)
+                   for order_id, shopping_list in items]
+        for future in as_completed(futures):
+            yield future.result()
 
 def main():
     try:
-        with open("layout_data.json", "r") as f:
-            data = json.load(f)
+        data = open_storage(LAYOUT_FILE).load_layout()
     except FileNotFoundError:
-        print("layout_data.json not found.")
+        print(f"{LAYOUT_FILE} not found.")
         return
 
-    rack_ids = data.get("rack_ids", [])
-    distance_map = data.get("distances", {})
-    product_map = data.get("products", {})
-
-    graph = build_graph(distance_map)
-    for node in rack_ids:
-        graph.setdefault(node, [])
+    # imported here because distance_matrix builds on this module
+    from distance_matrix import load_matrix, load_product_index
+    matrix = load_matrix(data, LAYOUT_FILE)
 
     print("\n🛒 CUSTOMER MODE: Enter products to buy (type 'done' to finish)")
     shopping_list = []
@@ -116,27 +511,22 @@ def main():
         if item:
             shopping_list.append(item)
 
-    racks_to_visit = []
-    for product in shopping_list:
-        found = False
-        for rack, item in product_map.items():
-            if str(item).strip().lower() == product:
-                racks_to_visit.append(rack)
-                found = True
-                break
-        if not found:
-            print(f"Product '{product}' not found")
+    racks_to_visit, missing = racks_for_products(
+        shopping_list, load_product_index(data, matrix), matrix)
+    for product in missing:
+        print(f"Product '{product}' not found")
 
     if not racks_to_visit:
         print(" No valid products found. Exiting.")
         return
 
-    route, total_distance = find_optimal_route(graph, racks_to_visit)
+    route, total_distance, exact = find_optimal_route(
+        None, racks_to_visit, with_status=True, matrix=matrix)
     if not route:
         print("Could not compute an optimal route for the selected racks.")
         return
 
-    print("\n Optimal route to follow:")
+    print("\n Optimal route to follow:" if exact else "\n Suggested route to follow (approximate):")
     print(" → ".join(route))
     print(f"✅ Total distance: {total_distance:.2f} units")
 
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import metrics
+from customer_route import build_graph, build_product_index
+from storage import write_json_atomic
+
+# above this many racks an n x n matrix is too slow to build on a request
+# (~0.4 s and under 1 MB of sidecar at 300), rows are computed on demand
+MATRIX_RACK_LIMIT = 300
+# rows a LazyDistanceMatrix keeps around
+LAZY_ROWS = 256
+
+# matrices already loaded in this process, keyed by layout version
+_loaded = {}
+# (layout version, rack assignments, product index) of the last layout routed
+_product_index = None
+
+def layout_version(rack_ids, distance_map):
+    """
+    Stable hash of the parts of a layout that affect routing.
+    """
+    payload = json.dumps([rack_ids, distance_map], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def matrix_filename(layout_file="layout_data.json"):
+    return os.path.splitext(layout_file)[0] + "_matrix.json"
+
+class DistanceMatrix:
+    """
+    All-pairs shortest distances and next hops for one layout version.
+    dist[i][j] is None when rack j cannot be reached from rack i.
+    """
+    def __init__(self, version, racks, dist, next_hop):
+        self.version = version
+        self.racks = racks
+        self.dist = dist
+        self.next_hop = next_hop
+        self.index = {rack: i for i, rack in enumerate(racks)}
+
+    @classmethod
+    def build(cls, version, graph):
+        racks = list(graph.nodes)
+        dist = []
+        next_hop = []
+        for source in range(len(racks)):
+            distances, pred = graph.dijkstra(source)
+            dist.append([None if d == float('inf') else d for d in distances])
+            # first step from source towards each target
+            hops = [None] * len(racks)
+            hops[source] = source
+            for target in range(len(racks)):
+                if hops[target] is not None or pred[target] == -1:
+                    continue
+                chain = []
+                node = target
+                while hops[node] is None and pred[node] != source:
+                    chain.append(node)
+                    node = pred[node]
+                if hops[node] is None:
+                    hops[node] = node
+                for step in chain:
+                    hops[step] = hops[node]
+            next_hop.append(hops)
+        return cls(version, racks, dist, next_hop)
+
+    def distance(self, a, b):
+        i, j = self.index.get(a), self.index.get(b)
+        if i is None or j is None:
+            return float('inf')
+        d = self.dist[i][j]
+        return float('inf') if d is None else d
+
+    def path(self, a, b):
+        """
+        Racks from a to b inclusive, or [] when b is unreachable.
+        """
+        i, j = self.index.get(a), self.index.get(b)
+        if i is None or j is None or self.dist[i][j] is None:
+            return []
+        path = [a]
+        while i != j:
+            i = self.next_hop[i][j]
+            path.append(self.racks[i])
+        return path
+
+    def save(self, filename):
+        # tills build and save concurrently: a tmp file per process, then one atomic replace
+        write_json_atomic(filename, {
+            "version": self.version,
+            "racks": self.racks,
+            "dist": self.dist,
+            "next": self.next_hop,
+        }, tmp=f"{filename}.{os.getpid()}.tmp")
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            data = json.load(f)
+        return cls(data["version"], data["racks"], data["dist"], data["next"])
+
+class LazyDistanceMatrix:
+    """
+    Same lookups as DistanceMatrix for very large layouts: one Dijkstra per
+    source rack on first use, keeping the most recent LAZY_ROWS rows.
+    """
+    def __init__(self, version, graph):
+        self.version = version
+        self.graph = graph
+        self.racks = graph.nodes
+        self._rows = OrderedDict()
+
+    def _row(self, source):
+        if source in self._rows:
+            self._rows.move_to_end(source)
+        else:
+            self._rows[source] = self.graph.dijkstra(source)
+            if len(self._rows) > LAZY_ROWS:
+                self._rows.popitem(last=False)
+        return self._rows[source]
+
+    def distance(self, a, b):
+        i, j = self.graph.index.get(a), self.graph.index.get(b)
+        if i is None or j is None:
+            return float('inf')
+        return self._row(i)[0][j]
+
+    def path(self, a, b):
+        if self.distance(a, b) == float('inf'):
+            return []
+        i, j = self.graph.index[a], self.graph.index[b]
+        return [self.racks[k] for k in self.graph.path_ids(self._row(i)[1], i, j)]
+
+@metrics.timed("load_matrix")
+def load_matrix(layout, layout_file="layout_data.json"):
+    """
+    Matrix for a parsed layout dict. Reuses the in-process copy or the
+    sidecar file when the layout version matches, otherwise rebuilds it.
+    """
+    rack_ids = layout.get("rack_ids", [])
+    distance_map = layout.get("distances", {})
+    version = layout_version(rack_ids, distance_map)
+    if version in _loaded:
+        return _loaded[version]
+
+    if len(rack_ids) > MATRIX_RACK_LIMIT:
+        matrix = LazyDistanceMatrix(version, build_graph(distance_map, rack_ids))
+        _loaded.clear()
+        _loaded[version] = matrix
+        return matrix
+
+    sidecar = matrix_filename(layout_file)
+    matrix = None
+    try:
+        matrix = DistanceMatrix.load(sidecar)
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    if matrix is None or matrix.version != version:
+        matrix = DistanceMatrix.build(version, build_graph(distance_map, rack_ids))
+        try:
+            matrix.save(sidecar)
+        except OSError:
+            pass
+
+    _loaded.clear()
+    _loaded[version] = matrix
+    return matrix
+
+def load_product_index(layout, matrix):
+    """
+    build_product_index for the layout's rack assignments, kept next to the
+    matrix and rebuilt only when the layout version or the assignments
+    change. Assignments are not part of the version, so they are compared.
+    """
+    global _product_index
+    product_map = layout.get("products", {})
+    cached = _product_index
+    if cached is None or cached[0] != matrix.version or cached[1] != product_map:
+        assignments = {rack: list(items) if isinstance(items, list) else items
+                       for rack, items in product_map.items()}
+        cached = (matrix.version, assignments, build_product_index(product_map))
+        _product_index = cached
+    return cached[2]
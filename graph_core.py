@@ -0,0 +1,145 @@
+import heapq
+from array import array
+from storage import is_sparse, iter_edges
+
+INF = float('inf')
+
+class Graph:
+    """
+    Rack graph with rack ids interned to dense integers 0..n-1 and the
+    adjacency held in flat CSR arrays: the edges leaving node i are
+    targets[offsets[i]:offsets[i + 1]] with the matching weights.
+    """
+    def __init__(self, nodes, edges):
+        self.nodes = list(nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.offsets, self.targets, self.weights = self._csr(len(self.nodes), edges)
+        self._reverse = None
+
+    @staticmethod
+    def _csr(n, edges):
+        # edges: (source id, target id, weight)
+        counts = [0] * (n + 1)
+        for a, b, w in edges:
+            counts[a + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        offsets = array('i', counts)
+        fill = list(counts[:n])
+        targets = array('i', [0]) * len(edges)
+        weights = array('d', [0.0]) * len(edges)
+        for a, b, w in edges:
+            k = fill[a]
+            targets[k] = b
+            weights[k] = w
+            fill[a] += 1
+        return offsets, targets, weights
+
+    @classmethod
+    def from_distances(cls, distance_map, rack_ids=()):
+        """
+        Build from a layout distances object (sparse or "A->B" form).
+        Every rack in rack_ids becomes a node even without edges.
+        """
+        nodes = dict.fromkeys(rack_ids)
+        if is_sparse(distance_map):
+            nodes.update(dict.fromkeys(distance_map["nodes"]))
+        named = list(iter_edges(distance_map))
+        for a, b, w in named:
+            nodes.setdefault(a)
+            nodes.setdefault(b)
+        index = {node: i for i, node in enumerate(nodes)}
+        return cls(nodes, [(index[a], index[b], w) for a, b, w in named])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def neighbors(self, node):
+        # (neighbor name, weight) pairs, for callers that think in rack ids
+        i = self.index[node]
+        return [(self.nodes[self.targets[k]], self.weights[k])
+                for k in range(self.offsets[i], self.offsets[i + 1])]
+
+    def reversed(self):
+        """
+        Graph with every edge flipped, built once and kept.
+        """
+        if self._reverse is None:
+            edges = [(self.targets[k], i, self.weights[k])
+                     for i in range(len(self.nodes))
+                     for k in range(self.offsets[i], self.offsets[i + 1])]
+            self._reverse = Graph(self.nodes, edges)
+        return self._reverse
+
+    def multi_source(self, sources, target=-1):
+        """
+        Dijkstra from every id in sources at once. Returns (dist, pred, origin)
+        lists indexed by node id: pred is -1 at sources and unreached nodes,
+        origin is the source each node was reached from. Stops early once
+        target (an id) is settled.
+        """
+        n = len(self.nodes)
+        dist = [INF] * n
+        pred = [-1] * n
+        origin = [-1] * n
+        queue = []
+        for s in sources:
+            dist[s] = 0.0
+            origin[s] = s
+            queue.append((0.0, s))
+        heapq.heapify(queue)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        pop, push = heapq.heappop, heapq.heappush
+        while queue:
+            cost, u = pop(queue)
+            if cost > dist[u]:
+                continue
+            if u == target:
+                break
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                new_cost = cost + weights[k]
+                if new_cost < dist[v]:
+                    dist[v] = new_cost
+                    pred[v] = u
+                    origin[v] = origin[u]
+                    push(queue, (new_cost, v))
+        return dist, pred, origin
+
+    def dijkstra(self, source):
+        """
+        Single-source shortest paths from id source: (dist, pred) lists.
+        """
+        dist, pred, _ = self.multi_source([source])
+        return dist, pred
+
+    def path_ids(self, pred, source, target):
+        # walk predecessors back from target; [] when target was not reached
+        if source == target:
+            return [source]
+        if pred[target] == -1:
+            return []
+        path = [target]
+        while path[-1] != source:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path
+
+    def shortest_path(self, start, end):
+        """
+        Point-to-point query by rack id: (path of rack ids, cost), or
+        (None, inf) when end cannot be reached.
+        """
+        if start not in self.index or end not in self.index:
+            return None, INF
+        s, t = self.index[start], self.index[end]
+        dist, pred, _ = self.multi_source([s], target=t)
+        if dist[t] == INF:
+            return None, INF
+        return [self.nodes[i] for i in self.path_ids(pred, s, t)], dist[t]
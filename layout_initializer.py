@@ -1,11 +1,114 @@
 
-import json
+import argparse
+import csv
+from storage import LAYOUT_FILE, open_storage
 from connection_prompt import collect_distances
 from product_assigner import assign_products_to_racks
 
 def generate_rack_ids(rows, cols):
     return [f"R{i+1}" for i in range(rows * cols)]
 
+def grid_coordinates(rows, cols):
+    """
+    Rack id -> (row, col), in the same order as generate_rack_ids.
+    """
+    return {rack: divmod(i, cols) for i, rack in enumerate(generate_rack_ids(rows, cols))}
+
+def grid_distances(rows, cols, aisle_length=1.0, cross_length=None):
+    """
+    Connect racks that sit next to each other in the grid: aisle_length
+    along a row, cross_length (default aisle_length) between rows.
+    Returns { (rack_a, rack_b): distance } both ways, adjacent racks only.
+    """
+    if cross_length is None:
+        cross_length = aisle_length
+    rack_ids = generate_rack_ids(rows, cols)
+    distances = {}
+    for i, rack in enumerate(rack_ids):
+        row, col = divmod(i, cols)
+        if col + 1 < cols:
+            right = rack_ids[i + 1]
+            distances[(rack, right)] = aisle_length
+            distances[(right, rack)] = aisle_length
+        if row + 1 < rows:
+            below = rack_ids[i + cols]
+            distances[(rack, below)] = cross_length
+            distances[(below, rack)] = cross_length
+    return distances
+
+def read_edge_file(path):
+    """
+    Stream "from,to,distance" rows from a CSV file in one pass.
+    Header rows, '#' comments and blank/0 distances (no path) are skipped.
+    Returns (rack_ids in first-seen order, { (rack_a, rack_b): distance } both ways).
+    """
+    racks = {}
+    distances = {}
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0].lstrip().startswith("#"):
+                continue
+            a, b, raw = row[0].strip().upper(), row[1].strip().upper(), row[2].strip()
+            try:
+                dist = float(raw) if raw else 0.0
+            except ValueError:
+                continue  # header row
+            racks.setdefault(a, None)
+            racks.setdefault(b, None)
+            if dist > 0:
+                distances[(a, b)] = dist
+                distances[(b, a)] = dist
+    return list(racks), distances
+
+def read_product_file(path):
+    """
+    "rack,product" rows; a rack listed several times holds several products.
+    """
+    product_map = {}
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].lstrip().startswith("#"):
+                continue
+            rack, product = row[0].strip().upper(), row[1].strip()
+            if product:
+                product_map.setdefault(rack, []).append(product)
+    return {r: p[0] if len(p) == 1 else p for r, p in product_map.items()}
+
+def split_cashiers(raw, rack_ids):
+    """
+    Parse a comma separated list of cashier racks. Returns (cashiers,
+    names that are not in rack_ids); a blank list keeps the single
+    cashier at the first rack.
+    """
+    cashiers = [r.strip().upper() for r in raw.split(",") if r.strip()]
+    known = set(rack_ids)
+    return cashiers or rack_ids[:1], [r for r in cashiers if r not in known]
+
+def prompt_cashiers(rack_ids):
+    while True:
+        raw = input("\n Cashier racks (comma separated, blank = first rack): ")
+        cashiers, unknown = split_cashiers(raw, rack_ids)
+        if not unknown:
+            return cashiers
+        print(f" Unknown racks: {', '.join(unknown)}")
+
+def build_layout(rack_ids, distance_map, product_map=None, cashiers=None):
+    """
+    layout_data.json document for bulk setups: only real edges are written,
+    pairs without a path are simply left out.
+    """
+    product_map = product_map or {}
+    return {
+        "rack_ids": rack_ids,
+        "distances": {
+            f"{a}->{b}": dist
+            for (a, b), dist in distance_map.items()
+            if dist != float('inf')
+        },
+        "products": {r: product_map.get(r, "unassigned") for r in rack_ids},
+        "cashiers": cashiers or rack_ids[:1],
+    }
+
 def parse_layout_size():
     while True:
         raw = input(" Enter your layout size (e.g. 3x3): ").lower().strip()
@@ -18,22 +121,40 @@ def parse_layout_size():
         else:
             print("Missing 'x'. Format must be like 3x3.")
 
-def save_to_json(data, filename="layout_data.json"):
+def save_to_json(data, filename=LAYOUT_FILE):
     # preserve existing inventory if present
-    try:
-        with open(filename, "r") as f:
-            existing = json.load(f)
-    except FileNotFoundError:
-        existing = {}
+    open_storage(filename).save_layout(data)
+    print(f"\nData saved to {filename}")
 
-    if isinstance(existing, dict) and "inventory" in existing:
-        data.setdefault("inventory", existing.get("inventory"))
+def bulk_main(args):
+    if args.edges:
+        rack_ids, distance_map = read_edge_file(args.edges)
+    else:
+        rows, cols = map(int, args.grid.lower().split('x'))
+        rack_ids = generate_rack_ids(rows, cols)
+        distance_map = grid_distances(rows, cols, args.aisle, args.cross)
+    product_map = read_product_file(args.products) if args.products else {}
+    cashiers, unknown = split_cashiers(args.cashiers or "", rack_ids)
+    if unknown:
+        raise SystemExit(f" Unknown cashier racks: {', '.join(unknown)}")
+    save_to_json(build_layout(rack_ids, distance_map, product_map, cashiers), args.output)
+    print(f" {len(rack_ids)} racks, {len(distance_map) // 2} aisle connections")
 
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=4)
-    print(f"\nData saved to {filename}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Set up the shop layout.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--grid", help="generate a rowsxcols grid with aisle edges, e.g. 100x100")
+    source.add_argument("--edges", help="CSV of from,to,distance rows")
+    parser.add_argument("--aisle", type=float, default=1.0, help="distance between racks in a row")
+    parser.add_argument("--cross", type=float, default=None, help="distance between rows")
+    parser.add_argument("--products", help="CSV of rack,product rows")
+    parser.add_argument("--cashiers", help="comma separated cashier racks")
+    parser.add_argument("--output", default=LAYOUT_FILE)
+    args = parser.parse_args(argv)
+    if args.grid or args.edges:
+        bulk_main(args)
+        return
 
-def main():
     rows, cols = parse_layout_size()
     rack_ids = generate_rack_ids(rows, cols)
 
@@ -44,6 +165,8 @@ def main():
     print("\n Assign products to racks:")
     product_map = assign_products_to_racks(rack_ids)
 
+    cashiers = prompt_cashiers(rack_ids)
+
     # Combine and save
     layout_data = {
         "rack_ids": rack_ids,
@@ -51,7 +174,8 @@ def main():
             f"{a}->{b}": ("∞" if dist == float('inf') else dist)
             for (a, b), dist in distance_map.items()
         },
-        "products": product_map
+        "products": product_map,
+        "cashiers": cashiers
     }
 
     save_to_json(layout_data)
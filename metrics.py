@@ -0,0 +1,180 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+# upper bounds (seconds) of the latency histogram buckets, +Inf is implied
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# prefix of every metric name in the Prometheus output
+PREFIX = "shop_"
+
+# SHOP_METRICS=1 turns recording on from start-up; SHOP_METRICS_FILE names a
+# file the snapshot is written to at exit (.prom for Prometheus text, else JSON)
+_enabled = os.environ.get("SHOP_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+# name -> [count, sum, per-bucket counts...]
+_histograms = {}
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def add(name, amount=1):
+    """
+    Increase counter name, e.g. add("save_cart_bytes_written", n).
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, seconds):
+    """
+    Record one latency sample in histogram name, counting the call too.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        entry = _histograms.get(name)
+        if entry is None:
+            entry = _histograms[name] = [0, 0.0] + [0] * (len(BUCKETS) + 1)
+        entry[0] += 1
+        entry[1] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry[2 + i] += 1
+                break
+        else:
+            entry[-1] += 1
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started)
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_no_timer = _NoTimer()
+
+def timer(name):
+    """
+    Context manager timing its block into histogram name; a shared no-op
+    object while recording is off.
+    """
+    return _Timer(name) if _enabled else _no_timer
+
+def timed(name):
+    """
+    Decorator timing every call of a function into histogram name.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def snapshot():
+    """
+    Everything recorded so far as plain data: counters, gauges and, per
+    histogram, count, sum and cumulative bucket counts keyed by upper bound.
+    """
+    with _lock:
+        histograms = {}
+        for name, entry in _histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, hits in zip(BUCKETS + (float('inf'),), entry[2:]):
+                cumulative += hits
+                buckets["+Inf" if bound == float('inf') else repr(bound)] = cumulative
+            histograms[name] = {"count": entry[0], "sum": entry[1], "buckets": buckets}
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": histograms,
+        }
+
+def to_json(data=None):
+    return json.dumps(data or snapshot(), indent=4, sort_keys=True)
+
+def to_prometheus(data=None):
+    """
+    Snapshot in the Prometheus text exposition format.
+    """
+    data = data or snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        lines.append(f"{PREFIX}{name}_total {value}")
+    for name, value in sorted(data["gauges"].items()):
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name} {value}")
+    for name, hist in sorted(data["histograms"].items()):
+        metric = f"{PREFIX}{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for bound, cumulative in hist["buckets"].items():
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {hist['sum']}")
+        lines.append(f"{metric}_count {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+def dump(filename, fmt=None):
+    """
+    Write a snapshot to filename; fmt "prometheus" or "json", by default
+    Prometheus for a .prom file and JSON otherwise.
+    """
+    if fmt is None:
+        fmt = "prometheus" if filename.endswith(".prom") else "json"
+    text = to_prometheus() if fmt == "prometheus" else to_json()
+    with open(filename, "w") as f:
+        f.write(text)
+
+def _dump_at_exit():
+    filename = os.environ.get("SHOP_METRICS_FILE")
+    if filename and _enabled:
+        try:
+            dump(filename)
+        except OSError as e:
+            print(f" Could not write metrics: {e}")
+
+atexit.register(_dump_at_exit)
@@ -2,12 +2,16 @@
 
 def assign_products_to_racks(rack_ids):
     """
-    Prompts user to assign a product to each rack.
-    Returns a dictionary: { rack_id: product_name }
+    Prompts user to assign products to each rack.
+    Several products can share a rack when separated by commas.
+    Returns a dictionary: { rack_id: product_name or [product_names] }
     """
     product_map = {}
     print("\n🛒 Assign products to each rack:")
     for rack in rack_ids:
-        product = input(f"{rack} → Product: ").strip()
-        product_map[rack] = product if product else "unassigned"
+        products = [p.strip() for p in input(f"{rack} → Product(s): ").split(",") if p.strip()]
+        if not products:
+            product_map[rack] = "unassigned"
+        else:
+            product_map[rack] = products[0] if len(products) == 1 else products
     return product_map
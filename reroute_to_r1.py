@@ -1,55 +1,68 @@
-import json
-import heapq
-
-def build_graph(distance_map):
-    graph = {}
-    for key, value in distance_map.items():
-        a, b = key.split("->")
-        if a not in graph:
-            graph[a] = []
-        try:
-            weight = float('inf') if str(value) == "∞" else float(value)
-        except ValueError:
-            weight = float('inf')
-        if weight != float('inf'):
-            graph[a].append((b, weight))
-    return graph
+from graph_core import Graph
+from storage import LAYOUT_FILE, open_storage
+from distance_matrix import layout_version
 
-def dijkstra(graph, start, end):
-    queue = [(0, start, [])]
-    visited = set()
-
-    while queue:
-        cost, node, path = heapq.heappop(queue)
-        if node in visited:
-            continue
-        visited.add(node)
-        path = path + [node]
+DEFAULT_CASHIER = "R1"
 
-        if node == end:
-            return path, cost
+# cashier trees already built in this process, keyed by layout version and tills
+_trees = {}
 
-        for neighbor, weight in graph.get(node, []):
-            if neighbor not in visited:
-                heapq.heappush(queue, (cost + weight, neighbor, path))
+def build_graph(distance_map, rack_ids=()):
+    return Graph.from_distances(distance_map, rack_ids)
 
-    return None, float('inf')
+def dijkstra(graph, start, end):
+    return graph.shortest_path(start, end)
+
+def cashier_racks(layout):
+    # tills default to R1 for layouts saved before cashiers were configurable
+    return layout.get("cashiers") or [DEFAULT_CASHIER]
+
+class CashierTree:
+    """
+    Reverse shortest-path tree rooted at every cashier rack at once.
+    For each rack: the nearest cashier, the distance to it and the next hop.
+    """
+    def __init__(self, graph, cashiers):
+        self.graph = graph
+        sources = [graph.index[c] for c in cashiers if c in graph]
+        # search the reversed graph so one pass covers every rack;
+        # a node's predecessor there is its next hop towards a till
+        self.dist, self.next_hop, self.nearest = graph.reversed().multi_source(sources)
+
+    def route(self, rack):
+        """
+        (path, distance, cashier) from rack to its nearest cashier,
+        or (None, inf, None) when no cashier can be reached.
+        """
+        i = self.graph.index.get(rack)
+        if i is None or self.nearest[i] == -1:
+            return None, float('inf'), None
+        nodes = self.graph.nodes
+        path = [rack]
+        while self.next_hop[i] != -1:
+            i = self.next_hop[i]
+            path.append(nodes[i])
+        return path, self.dist[self.graph.index[rack]], nodes[self.nearest[i]]
+
+def load_cashier_tree(layout):
+    """
+    Tree for a parsed layout, built once per layout version and cashier set.
+    """
+    cashiers = cashier_racks(layout)
+    key = (layout_version(layout.get("rack_ids", []), layout.get("distances", {})),
+           tuple(cashiers))
+    if key not in _trees:
+        _trees.clear()
+        graph = build_graph(layout.get("distances", {}), layout.get("rack_ids", []))
+        _trees[key] = CashierTree(graph, cashiers)
+    return _trees[key]
 
 def main():
     # Load layout data
-    with open("layout_data.json", "r") as f:
-        data = json.load(f)
+    data = open_storage(LAYOUT_FILE).load_layout()
 
     rack_ids = data["rack_ids"]
-    distance_map = data["distances"]
-
-    # Normalize distances
-    distance_map = {
-        k: float('inf') if v == "∞" else float(v)
-        for k, v in distance_map.items()
-    }
-
-    graph = build_graph(distance_map)
+    tree = load_cashier_tree(data)
 
     print("\nREROUTE MODE: Enter your current rack (e.g., R6)")
     current_rack = input("Current rack: ").strip().upper()
@@ -58,10 +71,10 @@ def main():
         print(f"Rack '{current_rack}' not found in layout.")
         return
 
-    path, total_distance = dijkstra(graph, current_rack, "R1")
+    path, total_distance, cashier = tree.route(current_rack)
 
     if path:
-        print("\nShortest path to R1:")
+        print(f"\nShortest path to {cashier}:")
         print(" → ".join(path))
         print(f"Total distance: {total_distance} units")
 
@@ -73,4 +86,4 @@ def main():
         print("Invalid input.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
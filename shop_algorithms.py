@@ -1,79 +1,884 @@
+import atexit
+import bisect
+import gc
 import heapq
 import json
+import os
+import pickle
+import threading
+import time
+import weakref
+from array import array
 from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import metrics
+from storage import (file_lock, is_ndjson_path, is_sqlite_path, iter_ndjson_inventory,
+                     open_storage, write_json_atomic, write_ndjson_inventory)
 
-class ProductHeap:
-    def __init__(self):
+# length of the substrings (trigrams) kept in the keyword search index
+GRAM_SIZE = 3
+# journal entries written before save_to_file/save_cart fold them into the snapshot
+COMPACT_AFTER = 500
+# PersistenceWorker writes at least this often (seconds) while state is dirty
+FLUSH_INTERVAL = 0.5
+# ... or as soon as this many saves have been handed to it
+FLUSH_BATCH = 50
+# compare-and-swap attempts on one SQLite row before a reservation gives up
+CAS_RETRIES = 100
+# records in the first page of a paged load; later pages double the heap
+PAGE_SIZE = 1000
+# format of the pickled heap snapshots; bump when the indexes change shape
+SNAPSHOT_VERSION = 2
+
+def _id_array():
+    # postings of the keyword index, a module function so the index pickles
+    return array('i')
+
+class Journal:
+    """
+    Append-only log of mutations kept next to a snapshot file.
+    Entries hold absolute record states, so replaying one twice is harmless.
+    """
+    def __init__(self, path, compact_after=COMPACT_AFTER, lock=None):
+        """
+        lock, a FileLock, is held around appends, rotation and merging when
+        other processes write to the same log.
+        """
+        self.path = path
+        self.rotated = path + ".old"
+        self.compact_after = compact_after
+        self.entries = 0
+        self._lock = threading.Lock()
+        self._process_lock = lock if lock is not None else nullcontext()
+        self._compactor = None
+
+    def append(self, entry):
+        """
+        Write entry as one line; returns the byte offsets it starts and ends at.
+        """
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._process_lock, self._lock:
+            # reopen each time so a rotation by another process is picked up
+            with open(self.path, "a+b") as f:
+                self._drop_torn_tail(f)
+                start = f.seek(0, os.SEEK_END)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries += 1
+        metrics.add("journal_bytes_written", len(line))
+        return start, start + len(line)
+
+    @staticmethod
+    def _drop_torn_tail(f):
+        """
+        Cut a partial last line left by a crash mid-append, so the next entry
+        starts on a line of its own instead of being glued onto it.
+        """
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                pos += newline + 1
+                break
+        if pos != end:
+            f.truncate(pos)
+
+    @staticmethod
+    def _read(path, offset=0):
+        """
+        Entries from byte offset on, and the offset just past the last one.
+        A torn last line from a crash ends the read; a complete line that does
+        not parse is skipped.
+        """
+        entries = []
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries, offset
+
+    def replay(self):
+        """
+        Entries of a rotated log still awaiting compaction, then the live log,
+        and the live log offset reached.
+        """
+        rotated = self._read(self.rotated)[0]
+        live, offset = self._read(self.path)
+        # a long log inherited from an earlier run still counts towards compaction
+        self.entries = len(rotated) + len(live)
+        return rotated + live, offset
+
+    def read_live(self, offset=0):
+        return self._read(self.path, offset)
+
+    def compact(self, merge, wait=False):
+        """
+        Rotate the live log and fold it into the snapshot on a background
+        thread. merge(entries) must rewrite the snapshot with entries applied.
+        """
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self.entries = 0
+
+            def run():
+                # a rotated log left by a crash or another process is merged first
+                with self._process_lock:
+                    with self._lock:
+                        if not os.path.exists(self.rotated):
+                            if not os.path.exists(self.path):
+                                return
+                            os.replace(self.path, self.rotated)
+                    merge(self._read(self.rotated)[0])
+                    os.remove(self.rotated)
+
+            self._compactor = threading.Thread(target=run, name="journal-compactor")
+            self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def maybe_compact(self, merge):
+        if self.entries >= self.compact_after:
+            self.compact(merge)
+
+class PersistenceWorker:
+    """
+    Background writer that coalesces saves. Each target keeps only the
+    latest state handed to it, and the thread writes every dirty target once
+    per interval, or sooner once batch_size saves are pending.
+    """
+    def __init__(self, interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending_writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_flush_latency = 0.0
+        self._dirty = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="persistence-worker", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, target, write, state, merge=None):
+        """
+        Queue write(state) for target, replacing any older unwritten state,
+        or with merge given, combining them as merge(older, state).
+        write must return the number of bytes it wrote.
+        """
+        with self._cond:
+            if target in self._dirty:
+                self.coalesced += 1
+                if merge is not None:
+                    state = merge(self._dirty[target][1], state)
+            self._dirty[target] = (write, state)
+            self.pending_writes += 1
+            if self.pending_writes >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # sleep until the interval passes or a full batch is waiting
+                self._cond.wait_for(
+                    lambda: self._closed or self.pending_writes >= self.batch_size,
+                    timeout=self.interval
+                )
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # already counted by flush; keep the thread alive for later saves
+                print(f" Background save failed: {e!r}")
+
+    def flush(self):
+        """
+        Write everything pending now, on the calling thread. A failing write
+        does not stop the others; the first error is raised once all have run.
+        """
+        with self._flush_lock:
+            with self._cond:
+                dirty, self._dirty = self._dirty, {}
+                self.pending_writes = 0
+            if not dirty:
+                return
+            started = time.perf_counter()
+            error = None
+            for write, state in dirty.values():
+                try:
+                    self.bytes_written += write(state)
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = repr(e)
+                    if error is None:
+                        error = e
+            self.last_flush_latency = time.perf_counter() - started
+            self.flushes += 1
+            if error is not None:
+                raise error
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending_writes": self.pending_writes,
+                "dirty_targets": len(self._dirty),
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "last_flush_latency": self.last_flush_latency,
+                "bytes_written": self.bytes_written,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+def _apply_inventory_entry(rows, entry):
+    # rows: (name, brand) lowercased -> (price, name, brand, quantity)
+    if "put" in entry:
+        p, n, b, q = entry["put"]
+        rows[(n.lower(), b.lower())] = (p, n, b, q)
+    elif "del" in entry:
+        rows.pop(tuple(entry["del"]), None)
+
+def _apply_cart_entry(cart, entry):
+    if "put" in entry:
+        n, b, qty = entry["put"]
+        cart[(n, b)] = qty
+    elif "del" in entry:
+        cart.pop(tuple(entry["del"]), None)
+    elif "clear" in entry:
+        cart.clear()
+
+class PriceListeners:
+    """
+    Price-change subscriptions shared by the inventory stores; subclasses
+    set self._price_listeners = [] when they initialise.
+    """
+
+    def on_price_change(self, listener):
+        """
+        Call listener(key, price) whenever the price of a product changes,
+        appears or disappears (price None); key is the lowercased
+        (name, brand), or None after a bulk load when anything may have
+        changed. Bound methods are held weakly, so a listening cart can be
+        dropped without unsubscribing.
+        """
+        if hasattr(listener, "__self__"):
+            self._price_listeners.append(weakref.WeakMethod(listener))
+        else:
+            self._price_listeners.append(lambda: listener)
+
+    def _notify_price(self, key, price):
+        if not self._price_listeners:
+            return
+        alive = []
+        for ref in self._price_listeners:
+            listener = ref()
+            if listener is not None:
+                alive.append(ref)
+                listener(key, price)
+        self._price_listeners = alive
+
+class ProductHeap(PriceListeners):
+    def __init__(self, journal=False, filename="layout_data.json", worker=None, shared=False,
+                 snapshot=False):
+        """
+        With journal=True every mutation is appended to <filename>.journal
+        and save_to_file only compacts that log into the snapshot now and then.
+        Otherwise, given a PersistenceWorker, save_to_file hands the records
+        changed since the last save to it, which folds them into the file,
+        instead of blocking. A .db filename stores inventory rows
+        in SQLite, where each mutation writes only its own row.
+
+        shared=True makes reserve() safe against other processes using the
+        same file: a compare-and-swap on the row for SQLite, otherwise a
+        file lock around catching up with and appending to the journal
+        (which shared mode turns on).
+
+        snapshot=True keeps the built heap and its indexes pickled next to
+        a JSON or NDJSON file (<name>_heap.pickle). Loads start from it
+        when the source has not been rewritten since, replaying any newer
+        journal lines, and write a fresh one after reading the source.
+        """
+        self.journal = journal or shared
+        self.worker = worker
+        self.shared = shared
+        self.snapshot = snapshot
+        # reserve() outcomes and time spent waiting on other processes
+        self.reservations = 0
+        self.refused = 0
+        self.cas_retries = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+        self._attach(filename)
         self.heap = []
+        # (name, brand) lowercased -> index of that record in self.heap
+        self._positions = {}
+        # distinct lowercased names and brands, id -> text and text -> id
+        self._strings = []
+        self._string_ids = {}
+        # trigram -> ids of the strings containing it; ids outlive the
+        # string's last record, searches find no records for those
+        self._grams = defaultdict(_id_array)
+        # lowercased brand -> keys of its records; names go through _brands
+        self._by_brand = {}
+        # (price, key) for every record, sorted: cheapest and price-range queries
+        self._by_price = []
+        # lowercased name -> [(price, brand key)] sorted, one entry per brand
+        self._brands = {}
+        # what the last load saw on disk, see reload_if_changed
+        self._seen = None
+        # callbacks told about price changes, see on_price_change
+        self._price_listeners = []
+        # key -> record, or None once deleted, changed since the last save to the worker
+        self._changes = {}
+        # (records still to come, source signature) while load_pages is under way
+        self._paging = None
+
+    @staticmethod
+    def _key(name, brand):
+        return (name.lower(), brand.lower())
+
+    @staticmethod
+    def _grams_of(text):
+        return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+    def _intern(self, text):
+        # string id of a lowercased name or brand, indexing it when new
+        i = self._string_ids.get(text)
+        if i is None:
+            i = len(self._strings)
+            self._strings.append(text)
+            self._string_ids[text] = i
+            for gram in self._grams_of(text):
+                self._grams[gram].append(i)
+        return i
+
+    def _index_text(self, key):
+        self._intern(key[0])
+        self._intern(key[1])
+        keys = self._by_brand.get(key[1])
+        if keys is None:
+            self._by_brand[key[1]] = keys = set()
+        keys.add(key)
+
+    def _unindex_text(self, key):
+        keys = self._by_brand[key[1]]
+        keys.discard(key)
+        if not keys:
+            del self._by_brand[key[1]]
+
+    def _reset_text_index(self):
+        self._strings = []
+        self._string_ids = {}
+        self._grams = defaultdict(_id_array)
+        self._by_brand = {}
+
+    def _attach(self, filename):
+        self.filename = filename
+        self.storage = open_storage(filename) if is_sqlite_path(filename) else None
+        self._stock_lock = None
+        if self.shared and self.storage is None:
+            self._stock_lock = file_lock(filename)
+        self._journal = None
+        if self.journal and self.storage is None:
+            self._journal = Journal(filename + ".journal", lock=self._stock_lock)
+        self._snapshot_file = None
+        if self.snapshot and self.storage is None:
+            self._snapshot_file = os.path.splitext(filename)[0] + "_heap.pickle"
+
+    def _log_put(self, key):
+        if self.storage is not None:
+            self.storage.put_item(self.heap[self._positions[key]])
+        elif self._journal is not None:
+            self._append({"put": list(self.heap[self._positions[key]])})
+        elif self.worker is not None:
+            self._changes[key] = self.heap[self._positions[key]]
+
+    def _log_del(self, key):
+        if self.storage is not None:
+            self.storage.delete_item(*key)
+        elif self._journal is not None:
+            self._append({"del": list(key)})
+        elif self.worker is not None:
+            self._changes[key] = None
+
+    def _append(self, entry):
+        start, end = self._journal.append(entry)
+        # nothing came between what we last read and our own line: skip it on
+        # the next reload instead of reading it back
+        if self._seen is not None and self._seen[1] == start:
+            self._seen = (self._seen[0], end)
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._positions[self._key(heap[i][1], heap[i][2])] = i
+        self._positions[self._key(heap[j][1], heap[j][2])] = j
+
+    def _sift_up(self, i):
+        heap = self.heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[i] < heap[parent]:
+                self._swap(i, parent)
+                i = parent
+            else:
+                break
+        return i
+
+    def _sift_down(self, i):
+        heap = self.heap
+        n = len(heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and heap[child] < heap[smallest]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def _index_price(self, key, price):
+        bisect.insort(self._by_price, (price, key))
+        bisect.insort(self._brands.setdefault(key[0], []), (price, key[1]))
+
+    def _unindex_price(self, key, price):
+        del self._by_price[bisect.bisect_left(self._by_price, (price, key))]
+        brands = self._brands[key[0]]
+        del brands[bisect.bisect_left(brands, (price, key[1]))]
+        if not brands:
+            del self._brands[key[0]]
+
+    def _replace(self, i, record):
+        # put record at slot i and restore heap order around it
+        old_price = self.heap[i][0]
+        self.heap[i] = record
+        if self._sift_up(i) == i:
+            self._sift_down(i)
+        if record[0] != old_price:
+            key = self._key(record[1], record[2])
+            self._unindex_price(key, old_price)
+            self._index_price(key, record[0])
+            self._notify_price(key, record[0])
+
+    def _rebuild(self, rows):
+        # bulk load from {key: record}: one heapify, then the indexes share
+        # the position map's key tuples
+        self.heap = list(rows.values())
+        heapq.heapify(self.heap)
+        self._positions = {
+            self._key(n, b): i for i, (p, n, b, q) in enumerate(self.heap)
+        }
+        self._reset_text_index()
+        for key in self._positions:
+            self._index_text(key)
+        heap = self.heap
+        self._by_price = sorted((heap[i][0], key) for key, i in self._positions.items())
+        self._brands = {}
+        for price, key in self._by_price:
+            self._brands.setdefault(key[0], []).append((price, key[1]))
+        self._notify_price(None, None)
+
+    def _extend(self, records):
+        # bulk insert: one heapify and one merge into the price index per call
+        fresh = {}
+        for record in records:
+            key = self._key(record[1], record[2])
+            if key in self._positions:
+                self._upsert(record)
+            else:
+                fresh[key] = record
+        if not fresh:
+            return
+        self.heap.extend(fresh.values())
+        heapq.heapify(self.heap)
+        self._positions = {
+            self._key(n, b): i for i, (p, n, b, q) in enumerate(self.heap)
+        }
+        for key in fresh:
+            self._index_text(key)
+        entries = sorted((r[0], key) for key, r in fresh.items())
+        self._by_price = list(heapq.merge(self._by_price, entries))
+        for price, key in entries:
+            bisect.insort(self._brands.setdefault(key[0], []), (price, key[1]))
+        self._notify_price(None, None)
+
+    def _upsert(self, record):
+        key = self._key(record[1], record[2])
+        i = self._positions.get(key)
+        if i is not None:
+            self._replace(i, record)
+        else:
+            self.heap.append(record)
+            self._positions[key] = len(self.heap) - 1
+            self._index_text(key)
+            self._index_price(key, record[0])
+            self._sift_up(len(self.heap) - 1)
+            self._notify_price(key, record[0])
+        return key
+
+    def _remove(self, key):
+        i = self._positions.pop(key, None)
+        if i is None:
+            return False
+        self._unindex_text(key)
+        self._unindex_price(key, self.heap[i][0])
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self._positions[self._key(last[1], last[2])] = i
+            if self._sift_up(i) == i:
+                self._sift_down(i)
+        self._notify_price(key, None)
+        return True
 
     def add_product(self, name, brand, price, quantity):
-        heapq.heappush(self.heap, (price, name.lower(), brand, quantity))
+        # adding an existing name/brand replaces that record
+        self._finish_loading()
+        key = self._upsert((price, name.lower(), brand, quantity))
+        self._log_put(key)
 
     def update_product(self, name, brand, price=None, quantity=None):
-        for i, (p, n, b, q) in enumerate(self.heap):
-            if n == name.lower() and b.lower() == brand.lower():
-                self.heap[i] = (
-                    price if price is not None else p,
-                    n,
-                    b,
-                    quantity if quantity is not None else q
-                )
-                heapq.heapify(self.heap)
-                return True
-        return False
+        self._finish_loading()
+        key = self._key(name, brand)
+        i = self._positions.get(key)
+        if i is None:
+            return False
+        p, n, b, q = self.heap[i]
+        self._replace(i, (
+            price if price is not None else p,
+            n,
+            b,
+            quantity if quantity is not None else q
+        ))
+        self._log_put(key)
+        return True
 
     def delete_product(self, name, brand):
-        self.heap = [
-            (p, n, b, q)
-            for p, n, b, q in self.heap
-            if not (n == name.lower() and b.lower() == brand.lower())
-        ]
-        heapq.heapify(self.heap)
+        self._finish_loading()
+        key = self._key(name, brand)
+        if self._remove(key):
+            self._log_del(key)
+
+    def get(self, name, brand):
+        """
+        The (price, name, brand, quantity) record for name/brand, or None.
+        """
+        i = self._positions.get(self._key(name, brand))
+        return None if i is None else self.heap[i]
 
+    def price(self, name, brand):
+        i = self._positions.get(self._key(name, brand))
+        return None if i is None else self.heap[i][0]
+
+    def stock(self, name, brand):
+        i = self._positions.get(self._key(name, brand))
+        return None if i is None else self.heap[i][3]
+
+    @metrics.timed("update_quantity")
     def update_quantity(self, name, brand, qty_change):
-        for i, (p, n, b, q) in enumerate(self.heap):
-            if n == name.lower() and b.lower() == brand.lower():
-                self.heap[i] = (p, n, b, q + qty_change)
-                heapq.heapify(self.heap)
+        self._finish_loading()
+        key = self._key(name, brand)
+        i = self._positions.get(key)
+        if i is None:
+            return False
+        p, n, b, q = self.heap[i]
+        self._replace(i, (p, n, b, q + qty_change))
+        self._log_put(key)
+        return True
+
+    @metrics.timed("reserve")
+    def reserve(self, name, brand, qty_change):
+        """
+        Change the stock of name/brand by qty_change unless that would take
+        it below zero. Returns False, changing nothing, for an unknown
+        product or not enough stock. With shared=True the check and the
+        change are atomic across processes.
+        """
+        self._finish_loading()
+        if self.storage is not None and self.shared:
+            return self._reserve_cas(name, brand, qty_change)
+        if self._stock_lock is None:
+            return self._reserve_local(name, brand, qty_change)
+        with self._stock_lock:
+            self._note_wait(self._stock_lock.last_wait)
+            # apply what other processes appended since we last looked
+            self.reload_if_changed(self.filename)
+            return self._reserve_local(name, brand, qty_change)
+
+    @contextmanager
+    def editing(self):
+        """
+        Hold the stock lock around catalogue edits and catch up with other
+        processes first, so a price change made here does not write back a
+        quantity the tills have since reserved. With SQLite the edits run in
+        one write transaction instead.
+        """
+        if self.storage is not None and self.shared:
+            self.storage.commit()
+            with self.storage.conn:
+                self.storage.conn.execute("BEGIN IMMEDIATE")
+                # data_version misses commits made on this process's own connection
+                rows, self._seen = self._read_rows()
+                self._apply_rows(rows)
+                yield self
+            return
+        with self._stock_lock or nullcontext():
+            self.reload_if_changed(self.filename)
+            yield self
+
+    def _reserve_local(self, name, brand, qty_change):
+        record = self.get(name, brand)
+        if record is None or record[3] + qty_change < 0:
+            self.refused += 1
+            return False
+        self.reservations += 1
+        return self.update_quantity(name, brand, qty_change)
+
+    def _reserve_cas(self, name, brand, qty_change):
+        for _ in range(CAS_RETRIES):
+            record = self.storage.get_item(name, brand)
+            if record is None:
+                self.refused += 1
+                return False
+            # keep the local copy as fresh as what we just read
+            self._upsert(tuple(record))
+            p, n, b, q = record
+            if q + qty_change < 0:
+                self.refused += 1
+                return False
+            started = time.perf_counter()
+            swapped = self.storage.swap_quantity(n, b, q, q + qty_change)
+            # includes SQLite's busy wait on another writer
+            self._note_wait(time.perf_counter() - started)
+            if swapped:
+                self._upsert((p, n, b, q + qty_change))
+                self.reservations += 1
                 return True
+            self.cas_retries += 1
+        self.refused += 1
         return False
 
+    def _note_wait(self, waited):
+        self.lock_wait_total += waited
+        self.lock_wait_max = max(self.lock_wait_max, waited)
+
+    def reservation_stats(self):
+        attempts = self.reservations + self.refused
+        return {
+            "reservations": self.reservations,
+            "refused": self.refused,
+            "cas_retries": self.cas_retries,
+            "lock_wait_total": self.lock_wait_total,
+            "lock_wait_max": self.lock_wait_max,
+            "lock_wait_avg": self.lock_wait_total / attempts if attempts else 0.0,
+        }
+
+    @metrics.timed("search_by_keyword")
     def search_by_keyword(self, keyword):
         keyword = keyword.lower()
-        return sorted([
-            (p, n, b, q) for p, n, b, q in self.heap
-            if keyword in n or keyword in b.lower()
-        ], key=lambda x: x[0])
+        if not keyword:
+            keys = self._positions
+        else:
+            keys = set()
+            for text in self._matching_strings(keyword):
+                keys.update((text, brand) for _, brand in self._brands.get(text, ()))
+                keys.update(self._by_brand.get(text, ()))
+        return sorted(
+            (self.heap[self._positions[k]] for k in keys),
+            key=lambda x: x[0]
+        )
+
+    def _matching_strings(self, keyword):
+        # names and brands containing keyword
+        strings = self._strings
+        if len(keyword) < GRAM_SIZE:
+            # too short for a trigram: scan the distinct strings
+            return [text for text in strings if keyword in text]
+        # every substring match contains all of the keyword's trigrams
+        postings = sorted(
+            (self._grams.get(gram, ()) for gram in self._grams_of(keyword)),
+            key=len
+        )
+        ids = set(postings[0]).intersection(*postings[1:])
+        return [strings[i] for i in ids if keyword in strings[i]]
+
+    def brands_by_price(self, name, k=None):
+        """
+        Records of product name, cheapest brand first; only the k cheapest
+        when k is given. O(k) from the per-product index.
+        """
+        name = name.lower()
+        entries = self._brands.get(name, ())
+        if k is not None:
+            entries = entries[:k]
+        return [self.heap[self._positions[(name, brand)]] for _, brand in entries]
+
+    def cheapest(self, k):
+        """
+        The k cheapest records across every product.
+        """
+        return [self.heap[self._positions[key]] for _, key in self._by_price[:k]]
+
+    def in_price_range(self, low, high):
+        """
+        Records priced from low to high inclusive, cheapest first.
+        O(log n + k) by bisecting the price index.
+        """
+        start = bisect.bisect_left(self._by_price, low, key=lambda e: e[0])
+        end = bisect.bisect_right(self._by_price, high, key=lambda e: e[0])
+        return [self.heap[self._positions[key]] for _, key in self._by_price[start:end]]
 
     def show_all_grouped(self):
         grouped = defaultdict(list)
-        for p, n, b, q in sorted(self.heap, key=lambda x: (x[1], x[0])):
-            grouped[n].append((b, p, q))
+        for name in sorted(self._brands):
+            for p, n, b, q in self.brands_by_price(name):
+                grouped[n].append((b, p, q))
         return grouped
 
-    def save_to_file(self, filename="layout_data.json"):
-        try:
-            with open(filename, "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {}
+    @metrics.timed("inventory_save")
+    def save_to_file(self, filename=None):
+        # default to the file this heap is attached to
+        if filename is None:
+            filename = self.filename
+        self._finish_loading()
+        metrics.set_gauge("product_heap_size", len(self.heap))
+        if filename != self.filename:
+            # a copy elsewhere: every record goes there, the heap stays on its own file
+            if is_sqlite_path(filename):
+                open_storage(filename).save_inventory(self.heap)
+            else:
+                self._write_inventory((filename, self.heap))
+            return
+        if self.storage is not None:
+            # rows were written as they changed, make them durable
+            self.storage.commit()
+            return
+        if self._journal is not None:
+            # mutations are already durable in the journal
+            self._journal.maybe_compact(self._merge_journal)
+            return
+        if self.worker is not None:
+            # hand over only the records that changed; the worker folds them into the file
+            changes, self._changes = self._changes, {}
+            self.worker.submit(("inventory", filename), self._write_changes,
+                               (filename, changes), merge=self._merge_changes)
+            return
+        self._write_inventory((filename, self.heap))
+
+    @staticmethod
+    def _merge_changes(older, newer):
+        # later changes to a record win over earlier ones
+        older[1].update(newer[1])
+        return older
 
-        # preserve existing keys, store inventory separately
-        data["inventory"] = [(p, n, b, q) for p, n, b, q in self.heap]
+    @staticmethod
+    def _write_changes(state):
+        # state: (filename, {key: record or None})
+        filename, changes = state
+        with file_lock(filename):
+            try:
+                rows = {ProductHeap._key(r[1], r[2]): r for r in ProductHeap._file_rows(filename)}
+            except FileNotFoundError:
+                rows = {}
+            for key, record in changes.items():
+                if record is None:
+                    rows.pop(key, None)
+                else:
+                    rows[key] = record
+            return ProductHeap._write_inventory((filename, rows.values()))
 
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=4)
+    @staticmethod
+    def _write_inventory(state):
+        filename, records = state
+        # admin layout saves rewrite the same file, keep out of each other's way
+        with file_lock(filename):
+            if is_ndjson_path(filename):
+                return write_ndjson_inventory(filename, records)
+            try:
+                with open(filename, "r") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
 
-    def load_from_file(self, filename="layout_data.json"):
+            # preserve existing keys, store inventory separately
+            data["inventory"] = [(p, n, b, q) for p, n, b, q in records]
+            written = write_json_atomic(filename, data, indent=4)
+        metrics.add("inventory_bytes_written", written)
+        return written
+
+    def compact(self, wait=False):
+        """
+        Fold the journal into the snapshot file now.
+        """
+        if self._journal is not None:
+            self._journal.compact(self._merge_journal, wait=wait)
+
+    def _merge_journal(self, entries):
+        # runs on the compactor thread: snapshot + rotated entries -> snapshot
+        with file_lock(self.filename):
+            # a heap that had caught up with the whole rotated log already holds
+            # the merged snapshot, so the next reload need not read it back
+            rotated = self._signature(self._journal.rotated)
+            current = rotated is not None and self._seen == (
+                (self._signature(self.filename), None), rotated[1])
+            self._merge_into_file(entries)
+            if current:
+                # the rotated log is removed next, under the same lock
+                self._seen = ((self._signature(self.filename), None), 0)
+
+    def _merge_into_file(self, entries):
+        if is_ndjson_path(self.filename):
+            try:
+                rows = {self._key(r[1], r[2]): r for r in iter_ndjson_inventory(self.filename)}
+            except FileNotFoundError:
+                rows = {}
+            for entry in entries:
+                _apply_inventory_entry(rows, entry)
+            write_ndjson_inventory(self.filename, rows.values())
+            return
         try:
-            with open(filename, "r") as f:
+            with open(self.filename, "r") as f:
                 data = json.load(f)
         except FileNotFoundError:
-            return
-
-        # reset current heap to avoid duplications on multiple loads
-        self.heap.clear()
+            data = {}
+        rows = {self._key(r[1], r[2]): r for r in self._inventory_rows(data)}
+        for entry in entries:
+            _apply_inventory_entry(rows, entry)
+        if not isinstance(data, dict):
+            data = {}
+        data["inventory"] = list(rows.values())
+        write_json_atomic(self.filename, data, indent=4)
 
+    @staticmethod
+    def _inventory_rows(data):
         records = None
 
         #  root is a list
@@ -87,18 +892,17 @@ class ProductHeap:
                 # convert products mapping into inventory records
                 products_map = data.get("products", {})
                 records = []
-                for rack, prod in products_map.items():
-                    if not prod:
-                        continue
-                    prod_str = str(prod).strip()
-                    if prod_str.lower() == "unassigned" or prod_str == "":
-                        continue
-                    # default price 0.0, brand "default", quantity 0
-                    records.append((0.0, prod_str.lower(), "default", 0))
-        if not records:
-            return
-
-        for record in records:
+                for rack, prods in products_map.items():
+                    for prod in prods if isinstance(prods, list) else [prods]:
+                        if not prod:
+                            continue
+                        prod_str = str(prod).strip()
+                        if prod_str.lower() == "unassigned" or prod_str == "":
+                            continue
+                        # default price 0.0, brand "default", quantity 0
+                        records.append((0.0, prod_str.lower(), "default", 0))
+        rows = []
+        for record in records or []:
             # support record length 3 or 4
             if len(record) == 4:
                 p, n, b, q = record
@@ -107,89 +911,455 @@ class ProductHeap:
                 q = 0
             else:
                 continue
-            heapq.heappush(self.heap, (p, n, b, q))
+            rows.append((p, n, b, q))
+        return rows
+
+    @staticmethod
+    def _file_rows(filename):
+        """
+        Records of an inventory file: streamed line by line from NDJSON,
+        from the parsed document otherwise. Raises FileNotFoundError at
+        once for a missing file.
+        """
+        if is_ndjson_path(filename):
+            return iter_ndjson_inventory(filename)
+        with open(filename, "r") as f, metrics.timer("inventory_json_parse"):
+            data = json.load(f)
+            metrics.add("inventory_bytes_read", f.tell())
+        return iter(ProductHeap._inventory_rows(data))
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _snapshot_signature(self):
+        if self._journal is None:
+            return (self._signature(self.filename),)
+        return (self._signature(self.filename), self._signature(self._journal.rotated))
+
+    def _read_rows(self):
+        """
+        Inventory on disk as {key: record}, plus what was seen while reading
+        it, or (None, None) when there is nothing to load.
+        """
+        if self.storage is not None:
+            seen = self.storage.data_version()
+            return {self._key(r[1], r[2]): r for r in self.storage.load_inventory()}, seen
+        signature = self._snapshot_signature()
+        try:
+            records = self._file_rows(self.filename)
+        except FileNotFoundError:
+            if self._journal is None:
+                return None, None
+            records = ()
+
+        latest = {self._key(r[1], r[2]): r for r in records}
+        offset = 0
+        if self._journal is not None:
+            entries, offset = self._journal.replay()
+            for entry in entries:
+                _apply_inventory_entry(latest, entry)
+        return latest, (signature, offset)
+
+    @metrics.timed("inventory_load")
+    def load_from_file(self, filename=None):
+        if filename is None:
+            filename = self.filename
+        if filename != self.filename:
+            self._attach(filename)
+        if self._snapshot_file is not None and self._load_snapshot():
+            seen = self._seen
+            # catch up with journal lines or a rewrite since the snapshot
+            self.reload_if_changed()
+            if self._seen[0] != seen[0]:
+                self._save_snapshot()
+            metrics.set_gauge("product_heap_size", len(self.heap))
+            return
+        rows, seen = self._read_rows()
+        if rows is None:
+            return
+        # reset current heap to avoid duplications on multiple loads
+        self._rebuild(rows)
+        self._seen = seen
+        metrics.set_gauge("product_heap_size", len(self.heap))
+        if self._snapshot_file is not None:
+            self._save_snapshot()
+
+    def _save_snapshot(self):
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "seen": self._seen,
+            "heap": self.heap,
+            "positions": self._positions,
+            "strings": self._strings,
+            "grams": self._grams,
+            "by_brand": self._by_brand,
+            "by_price": self._by_price,
+            "brands": self._brands,
+        }
+        tmp = f"{self._snapshot_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                metrics.add("inventory_snapshot_bytes_written", f.tell())
+            os.replace(tmp, self._snapshot_file)
+        except OSError:
+            # only a cache; the next load reads the source again
+            pass
+
+    @metrics.timed("inventory_snapshot_load")
+    def _load_snapshot(self):
+        """
+        Install the pickled heap if it is this version's and was taken
+        from the source file as it is now; False when there is none to use.
+        """
+        # millions of new objects would set off collections that find nothing
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self._snapshot_file, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return False
+        finally:
+            if collecting:
+                gc.enable()
+        if not isinstance(state, dict) or state.get("version") != SNAPSHOT_VERSION:
+            return False
+        seen = state["seen"]
+        if seen is None or seen[0] != self._snapshot_signature():
+            return False
+        self.heap = state["heap"]
+        self._positions = state["positions"]
+        self._strings = state["strings"]
+        self._string_ids = {text: i for i, text in enumerate(self._strings)}
+        self._grams = state["grams"]
+        self._by_brand = state["by_brand"]
+        self._by_price = state["by_price"]
+        self._brands = state["brands"]
+        self._seen = seen
+        self._notify_price(None, None)
+        return True
+
+    def load_pages(self, filename=None, page_size=PAGE_SIZE):
+        """
+        Load the inventory a page at a time, yielding the number of records
+        loaded so far after each page. Between pages the heap is complete
+        for what it holds, so a session can browse while the rest arrives.
+        Pages double in size to keep the whole load O(n log n). Journalled
+        and SQLite inventories load in one page, as their changes only make
+        sense on top of the full snapshot.
+        """
+        if filename is None:
+            filename = self.filename
+        if filename != self.filename:
+            self._attach(filename)
+        if self.storage is not None or self._journal is not None:
+            self.load_from_file()
+            yield len(self.heap)
+            return
+        signature = self._snapshot_signature()
+        try:
+            records = self._file_rows(filename)
+        except FileNotFoundError:
+            return
+        self._rebuild({})
+        self._paging = (records, signature)
+        page = []
+        for record in records:
+            page.append(record)
+            if len(page) >= max(page_size, len(self.heap)):
+                self._extend(page)
+                page = []
+                yield len(self.heap)
+        self._extend(page)
+        self._paging = None
+        self._seen = (signature, 0)
+        metrics.set_gauge("product_heap_size", len(self.heap))
+        yield len(self.heap)
+
+    def _finish_loading(self):
+        """
+        Take in what a paged load has not yet reached, before anything is
+        changed or written: a later page would otherwise overwrite the change,
+        and a save would write out a partial catalog. The suspended
+        load_pages then finds nothing left and ends.
+        """
+        if self._paging is None:
+            return
+        records, signature = self._paging
+        self._paging = None
+        self._extend(list(records))
+        self._seen = (signature, 0)
+        metrics.set_gauge("product_heap_size", len(self.heap))
+
+    def _apply_rows(self, rows):
+        # bring the heap in line with rows, touching only records that differ
+        changed = 0
+        for key in [k for k in self._positions if k not in rows]:
+            self._remove(key)
+            changed += 1
+        for key, record in rows.items():
+            i = self._positions.get(key)
+            if i is None or self.heap[i] != record:
+                self._upsert(record)
+                changed += 1
+        return changed
+
+    def reload_if_changed(self, filename=None):
+        """
+        Cheap refresh for long-running sessions: returns how many records
+        changed, and 0 without reading anything when nothing on disk moved.
+        New journal lines are applied from the tail; any other change
+        re-reads the source and patches only the records that differ.
+        """
+        if filename is None:
+            filename = self.filename
+        if filename != self.filename or self._seen is None:
+            self.load_from_file(filename)
+            return len(self.heap)
+        if self.storage is not None:
+            if self.storage.data_version() == self._seen:
+                return 0
+        elif self._snapshot_signature() == self._seen[0]:
+            if self._journal is None:
+                return 0
+            signature, offset = self._seen
+            live = self._signature(self._journal.path)
+            size = live[1] if live else 0
+            if size == offset:
+                return 0
+            if size > offset:
+                entries, end = self._journal.read_live(offset)
+                for entry in entries:
+                    if "put" in entry:
+                        self._upsert(tuple(entry["put"]))
+                    elif "del" in entry:
+                        self._remove(tuple(entry["del"]))
+                self._seen = (signature, end)
+                return len(entries)
+
+        rows, seen = self._read_rows()
+        if rows is None:
+            return 0
+        changed = self._apply_rows(rows)
+        self._seen = seen
+        return changed
 
 class CartManager:
-    def __init__(self, cart_file="cart.json"):
+    def __init__(self, cart_file="cart.json", journal=False, worker=None, cart_id="default"):
         self.cart_file = cart_file
+        self.worker = worker
+        self.cart_id = cart_id
         self.cart = defaultdict(int)
+        # cart_file=None keeps the cart in memory only (service sessions)
+        self.storage = open_storage(cart_file) if cart_file and is_sqlite_path(cart_file) else None
+        self._journal = None
+        if journal and cart_file and self.storage is None:
+            self._journal = Journal(cart_file + ".journal")
+        # (name, brand) -> price * qty for lines whose product is on sale,
+        # and their sum; kept up to date as lines and prices change
+        self.subtotals = {}
+        self.total = 0.0
+        self._heap = None
         self.load_cart()
 
     def load_cart(self):
+        if self.cart_file is None:
+            return
+        if self.storage is not None:
+            for n, b, qty in self.storage.load_cart(self.cart_id):
+                self.cart[(n, b)] = qty
+            return
         try:
             with open(self.cart_file, "r") as f:
                 for n, b, qty in json.load(f):
                     self.cart[(n, b)] = qty
         except FileNotFoundError:
             pass
+        if self._journal is not None:
+            for entry in self._journal.replay()[0]:
+                _apply_cart_entry(self.cart, entry)
+
+    def _log_line(self, name, brand):
+        if self.storage is not None:
+            if (name, brand) in self.cart:
+                self.storage.put_cart_line(name, brand, self.cart[(name, brand)], self.cart_id)
+            else:
+                self.storage.delete_cart_line(name, brand, self.cart_id)
+            return
+        if self._journal is None:
+            return
+        if (name, brand) in self.cart:
+            self._journal.append({"put": [name, brand, self.cart[(name, brand)]]})
+        else:
+            self._journal.append({"del": [name, brand]})
 
+    @metrics.timed("save_cart")
     def save_cart(self):
-        with open(self.cart_file, "w") as f:
-            json.dump([(n, b, qty) for (n, b), qty in self.cart.items()], f)
+        if self.cart_file is None:
+            return
+        if self.storage is not None:
+            self.storage.commit()
+            return
+        if self._journal is not None:
+            self._journal.maybe_compact(self._merge_journal)
+            return
+        lines = [(n, b, qty) for (n, b), qty in self.cart.items()]
+        if self.worker is not None:
+            self.worker.submit(("cart", self.cart_file), self._write_cart, (self.cart_file, lines))
+            return
+        self._write_cart((self.cart_file, lines))
+
+    @staticmethod
+    def _write_cart(state):
+        cart_file, lines = state
+        payload = json.dumps(lines).encode("utf-8")
+        with open(cart_file, "wb") as f:
+            f.write(payload)
+        written = len(payload)
+        metrics.add("cart_bytes_written", written)
+        return written
+
+    def _merge_journal(self, entries):
+        cart = {}
+        try:
+            with open(self.cart_file, "r") as f:
+                for n, b, qty in json.load(f):
+                    cart[(n, b)] = qty
+        except FileNotFoundError:
+            pass
+        for entry in entries:
+            _apply_cart_entry(cart, entry)
+        write_json_atomic(self.cart_file, [(n, b, qty) for (n, b), qty in cart.items()])
+
+    def _bind(self, products_heap):
+        # first use against a heap: follow its prices and price every line
+        if self._heap is not products_heap:
+            self._heap = products_heap
+            products_heap.on_price_change(self._price_changed)
+            self.recalculate()
+
+    def recalculate(self):
+        """
+        Price every line from scratch, e.g. after editing self.cart directly.
+        """
+        self.subtotals = {}
+        if self._heap is not None:
+            for (name, brand), qty in self.cart.items():
+                price = self._heap.price(name, brand)
+                if price is not None:
+                    self.subtotals[(name, brand)] = price * qty
+        self.total = sum(self.subtotals.values())
+
+    def _update_line(self, name, brand):
+        key = (name, brand)
+        subtotal = 0.0
+        price = self._heap.price(name, brand) if key in self.cart else None
+        if price is not None:
+            subtotal = price * self.cart[key]
+            self.total += subtotal - self.subtotals.get(key, 0.0)
+            self.subtotals[key] = subtotal
+        else:
+            self.total -= self.subtotals.pop(key, 0.0)
+
+    def _price_changed(self, key, price):
+        if key is None:
+            self.recalculate()
+            return
+        for name, brand in [line for line in self.cart if ProductHeap._key(*line) == key]:
+            self._update_line(name, brand)
 
     def add_item(self, name, brand, qty, products_heap):
-        if products_heap.update_quantity(name, brand, -qty):
+        self._bind(products_heap)
+        if products_heap.reserve(name, brand, -qty):
             self.cart[(name, brand)] += qty
+            self._update_line(name, brand)
+            self._log_line(name, brand)
             self.save_cart()
             products_heap.save_to_file()
             return True
         return False
 
     def remove_item(self, name, brand, products_heap):
+        self._bind(products_heap)
         if (name, brand) in self.cart:
             qty = self.cart[(name, brand)]
-            products_heap.update_quantity(name, brand, qty)
+            products_heap.reserve(name, brand, qty)
             del self.cart[(name, brand)]
+            self._update_line(name, brand)
+            self._log_line(name, brand)
             self.save_cart()
             products_heap.save_to_file()
 
     def modify_item(self, name, brand, new_qty, products_heap):
+        self._bind(products_heap)
         if (name, brand) not in self.cart:
             return False
         current = self.cart[(name, brand)]
         diff = new_qty - current
         if diff > 0:
-            if not products_heap.update_quantity(name, brand, -diff):
+            if not products_heap.reserve(name, brand, -diff):
                 return False
         else:
-            products_heap.update_quantity(name, brand, -diff)
+            products_heap.reserve(name, brand, -diff)
         self.cart[(name, brand)] = new_qty
+        self._update_line(name, brand)
+        self._log_line(name, brand)
         self.save_cart()
         products_heap.save_to_file()
         return True
-    def checkout(self, products_heap):
-        if not self.cart:
-            print("\n Cart is empty.")
-            return
-
-        # Build a flat list of all items with their computed subtotals
-        items = []
-        for (name, brand), qty in self.cart.items():
-            price = next(
-                (p for p, n, b, _ in products_heap.heap
-                 if n == name and b == brand),
-                None
-            )
-            if price is None:
-                continue
-            subtotal = price * qty
-            items.append((subtotal, name, brand, qty, price))
 
+    def bill(self, products_heap):
+        """
+        Cart lines as (subtotal, name, brand, qty, price), lowest subtotal
+        first, and the total. Lines whose product is gone are left out.
+        """
+        self._bind(products_heap)
+        items = [
+            (subtotal, name, brand, self.cart[(name, brand)], products_heap.price(name, brand))
+            for (name, brand), subtotal in self.subtotals.items()
+        ]
         # Sort items by subtotal lowest first
         items.sort(key=lambda x: x[0])
+        return items, self.total
 
-        # Print in the flat 
-        print("\n Products Bills:")
-        total = 0.0
-        for subtotal, name, brand, qty, price in items:
-            print(f"   {name.title()} - {brand} x {qty} @ Rs {price:.2f} = Rs {subtotal:.2f}")
-            total += subtotal
+    @metrics.timed("checkout")
+    def checkout(self, products_heap, echo=True, flush=True):
+        """
+        Settle the cart and clear it. Returns the bill from bill(), or None
+        when the cart is empty. echo=False skips printing it; flush=False
+        leaves flushing the persistence workers to the caller.
+        """
+        if not self.cart:
+            if echo:
+                print("\n Cart is empty.")
+            return None
 
-        # Print total and clear cart
-        print(f"\nTotal Bill :- Rs {total:.2f}")
-        print(" Checkout complete. Thank you for shopping!")
+        items, total = self.bill(products_heap)
+        if echo:
+            print("\n Products Bills:")
+            for subtotal, name, brand, qty, price in items:
+                print(f"   {name.title()} - {brand} x {qty} @ Rs {price:.2f} = Rs {subtotal:.2f}")
+            print(f"\nTotal Bill :- Rs {total:.2f}")
+            print(" Checkout complete. Thank you for shopping!")
 
         # Persist changes clear cart & save files
         self.cart.clear()
+        self.subtotals = {}
+        self.total = 0.0
+        if self.storage is not None:
+            self.storage.clear_cart(self.cart_id)
+        elif self._journal is not None:
+            self._journal.append({"clear": True})
         self.save_cart()
         products_heap.save_to_file()
+        # a finished sale must be on disk before the customer leaves
+        if flush:
+            for worker in {self.worker, products_heap.worker} - {None}:
+                worker.flush()
+        return items, total
@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+from shop_algorithms import ProductHeap, CartManager
+from storage import LAYOUT_FILE, open_storage
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# processes solving routes; the event loop never runs a route itself
+ROUTE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# longest request line accepted from a client
+MAX_LINE = 64 * 1024
+
+# parsed layouts held by each route process, keyed by file path
+_layouts = {}
+
+def _layout(layout_file):
+    # re-read only when the file moved since the last request
+    try:
+        st = os.stat(layout_file)
+        signature = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        signature = None
+    cached = _layouts.get(layout_file)
+    if cached is None or cached[0] != signature:
+        cached = (signature, open_storage(layout_file).load_layout())
+        _layouts[layout_file] = cached
+    return cached[1]
+
+def plan_route(layout_file, shopping_list):
+    """
+    Route for a shopping list; runs in a route process.
+    """
+    from customer_route import find_optimal_route, racks_for_products
+    from distance_matrix import load_matrix, load_product_index
+    layout = _layout(layout_file)
+    matrix = load_matrix(layout, layout_file)
+    racks, missing = racks_for_products(
+        shopping_list, load_product_index(layout, matrix), matrix)
+    result = {"route": [], "distance": None, "exact": True, "missing": missing}
+    if racks:
+        route, distance, exact = find_optimal_route(
+            None, racks, with_status=True, matrix=matrix)
+        if route:
+            result.update(route=route, distance=distance, exact=exact)
+    return result
+
+def plan_reroute(layout_file, rack):
+    """
+    Path from rack to its nearest cashier; runs in a route process.
+    """
+    from reroute_to_r1 import load_cashier_tree
+    layout = _layout(layout_file)
+    if rack not in layout.get("rack_ids", []):
+        raise ValueError(f"Rack '{rack}' not found in layout.")
+    path, distance, cashier = load_cashier_tree(layout).route(rack)
+    if not path:
+        raise ValueError(f"No cashier reachable from {rack}.")
+    return {"path": path, "distance": distance, "cashier": cashier}
+
+def _text(request, field):
+    value = request.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{field}' must be a non-empty string")
+    return value.strip()
+
+def _quantity(request):
+    value = request.get("qty")
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ValueError("'qty' must be a positive integer")
+    return value
+
+def _lines(items):
+    return [{"name": name, "brand": brand, "qty": qty, "price": price, "subtotal": subtotal}
+            for subtotal, name, brand, qty, price in items]
+
+class ShopService:
+    """
+    The customer menu as a line-delimited JSON service.
+
+    Every connection is a session with its own in-memory cart; all sessions
+    share one ProductHeap, which the service owns while it runs. Requests
+    are JSON objects such as {"op": "add", "name": "milk", "brand": "anchor",
+    "qty": 2}, one per line; each gets one reply line, {"ok": true,
+    "result": ...} or {"ok": false, "error": "..."}, echoing "id" if given.
+
+    Heap and cart operations run one at a time on a single stock thread,
+    so they never interleave, and the lock, reload and fsync'd journal
+    append behind each stock change never stall the event loop. Route
+    solving goes to a process pool. Inventory comes from inventory_file,
+    by default the layout file, and is journaled under the same lock the
+    customer menu's tills take, so reservations made there are kept; carts
+    live in memory only. A catalog that can be paged loads its first page
+    before the service listens and the rest a page at a time on the stock
+    thread while sessions browse.
+    """
+    def __init__(self, layout_file=LAYOUT_FILE, route_workers=ROUTE_WORKERS, inventory_file=None):
+        self.layout_file = layout_file
+        self.inventory_file = inventory_file or layout_file
+        self.products_heap = ProductHeap(journal=True, filename=self.inventory_file, shared=True)
+        self._pages = self.products_heap.load_pages()
+        next(self._pages, None)
+        self.loading = True
+        # convert a legacy layout here, before any route process reads it
+        open_storage(layout_file).load_layout()
+        self.route_workers = route_workers
+        self.routes = self._route_pool()
+        # the only thread that touches products_heap and the carts once serving
+        self.stock = ThreadPoolExecutor(1, thread_name_prefix="stock")
+        self.sessions = 0
+        self.requests = 0
+        self._next_session = 1
+        self.ops = {
+            "search": self._on_stock(self.search),
+            "products": self._on_stock(self.products),
+            "cheapest": self._on_stock(self.cheapest),
+            "price_range": self._on_stock(self.price_range),
+            "cart": self._on_stock(self.view_cart),
+            "add": self._on_stock(self.add),
+            "modify": self._on_stock(self.modify),
+            "remove": self._on_stock(self.remove),
+            "checkout": self._on_stock(self.checkout),
+            "route": self.route,
+            "reroute": self.reroute,
+            "stats": self.stats,
+            "metrics": self.metrics,
+        }
+
+    def _route_pool(self):
+        # spawn, not fork: children must not share the parent's sqlite handles
+        return ProcessPoolExecutor(
+            self.route_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def _stock(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.stock, func, *args)
+
+    def _on_stock(self, func):
+        # the op as a coroutine that runs func(cart, request) on the stock thread
+        async def op(cart, request):
+            return await self._stock(func, cart, request)
+        return op
+
+    def search(self, cart, request):
+        results = self.products_heap.search_by_keyword(_text(request, "keyword"))
+        return [{"name": n, "brand": b, "price": p, "qty": q}
+                for p, n, b, q in sorted(results, key=lambda r: (r[1], r[0]))]
+
+    def products(self, cart, request):
+        return {name: [{"brand": b, "price": p, "qty": q} for b, p, q in brands]
+                for name, brands in self.products_heap.show_all_grouped().items()}
+
+    def cheapest(self, cart, request):
+        # {"op": "cheapest", "k": 3} overall, or with "name" for one product
+        k = request.get("k", 1)
+        if not isinstance(k, int) or isinstance(k, bool) or k <= 0:
+            raise ValueError("'k' must be a positive integer")
+        if "name" in request:
+            records = self.products_heap.brands_by_price(_text(request, "name"), k)
+        else:
+            records = self.products_heap.cheapest(k)
+        return [{"name": n, "brand": b, "price": p, "qty": q} for p, n, b, q in records]
+
+    def price_range(self, cart, request):
+        low, high = request.get("low"), request.get("high")
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (low, high)):
+            raise ValueError("'low' and 'high' must be numbers")
+        return [{"name": n, "brand": b, "price": p, "qty": q}
+                for p, n, b, q in self.products_heap.in_price_range(low, high)]
+
+    def view_cart(self, cart, request):
+        items, total = cart.bill(self.products_heap)
+        return {"lines": _lines(items), "total": total}
+
+    def _item(self, request):
+        # cart lines use the heap's spelling of name and brand
+        record = self.products_heap.get(_text(request, "name"), _text(request, "brand"))
+        if record is None:
+            raise ValueError("No such product.")
+        return record[1], record[2]
+
+    def _check_stock(self, name, brand, wanted):
+        stock = self.products_heap.get(name, brand)[3]
+        if wanted > stock:
+            raise ValueError(f"Invalid quantity. Available: {stock}")
+
+    def add(self, cart, request):
+        name, brand = self._item(request)
+        qty = _quantity(request)
+        self._check_stock(name, brand, qty)
+        if not cart.add_item(name, brand, qty, self.products_heap):
+            raise ValueError("Could not add to cart.")
+        return {"qty": cart.cart[(name, brand)]}
+
+    def modify(self, cart, request):
+        name, brand = self._item(request)
+        qty = _quantity(request)
+        self._check_stock(name, brand, qty - cart.cart.get((name, brand), 0))
+        if not cart.modify_item(name, brand, qty, self.products_heap):
+            raise ValueError("Could not update item.")
+        return {"qty": cart.cart[(name, brand)]}
+
+    def remove(self, cart, request):
+        name, brand = self._item(request)
+        if (name, brand) not in cart.cart:
+            raise ValueError("Item is not in the cart.")
+        cart.remove_item(name, brand, self.products_heap)
+        return {}
+
+    def checkout(self, cart, request):
+        # the heap's journal has every reservation on disk already
+        bill = cart.checkout(self.products_heap, echo=False)
+        if bill is None:
+            raise ValueError("Cart is empty.")
+        items, total = bill
+        return {"lines": _lines(items), "total": total}
+
+    async def route(self, cart, request):
+        products = request.get("products")
+        if not isinstance(products, list) or not all(isinstance(p, str) for p in products):
+            raise ValueError("'products' must be a list of product names")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.routes, plan_route, self.layout_file, products)
+
+    async def reroute(self, cart, request):
+        rack = _text(request, "rack").upper()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.routes, plan_reroute, self.layout_file, rack)
+
+    async def stats(self, cart, request):
+        return {"sessions": self.sessions, "requests": self.requests,
+                "inventory": {"loaded": len(self.products_heap.heap), "loading": self.loading},
+                "reservations": self.products_heap.reservation_stats()}
+
+    async def metrics(self, cart, request):
+        # {"op": "metrics", "format": "prometheus"} for the text exposition
+        if request.get("format") == "prometheus":
+            return metrics.to_prometheus()
+        return metrics.snapshot()
+
+    async def _reply(self, cart, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "error": "request is not valid JSON"}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "request must be a JSON object"}
+        reply = {"id": request["id"]} if "id" in request else {}
+        op = self.ops.get(request.get("op"))
+        if op is None:
+            reply.update(ok=False, error=f"unknown op {request.get('op')!r}")
+            return reply
+        self.requests += 1
+        try:
+            reply.update(ok=True, result=await op(cart, request))
+        except (ValueError, OSError) as e:
+            reply.update(ok=False, error=str(e))
+        except BrokenProcessPool:
+            # a route process died and took the pool with it; later routes get a new one
+            self.routes.shutdown(wait=False)
+            self.routes = self._route_pool()
+            reply.update(ok=False, error="route worker failed, please retry")
+        except Exception as e:
+            # anything else fails this request only, never the session
+            reply.update(ok=False, error=f"{type(e).__name__}: {e}")
+        return reply
+
+    async def handle(self, reader, writer):
+        session = self._next_session
+        self._next_session += 1
+        self.sessions += 1
+        cart = CartManager(None, cart_id=f"session-{session}")
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # line over MAX_LINE or the client went away
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self._reply(cart, line)
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # an abandoned cart gives its stock back
+            if cart.cart:
+                await self._stock(self._release, cart)
+            self.sessions -= 1
+            writer.close()
+
+    def _release(self, cart):
+        for name, brand in list(cart.cart):
+            cart.remove_item(name, brand, self.products_heap)
+
+    async def load_rest(self):
+        # the catalog after its first page; requests queued on the stock thread run between pages
+        while await self._stock(next, self._pages, None) is not None:
+            pass
+        self.loading = False
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        loader = asyncio.create_task(self.load_rest())
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        where = path or f"{host}:{port}"
+        print(f" Shop service listening on {where}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            loader.cancel()
+            self.close()
+
+    def close(self):
+        self.routes.shutdown(cancel_futures=True)
+        self.stock.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the shop over a local socket.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this unix socket path instead of TCP")
+    parser.add_argument("--layout", default=LAYOUT_FILE)
+    parser.add_argument("--inventory", help="inventory file (.json, .ndjson or .db), default the layout")
+    parser.add_argument("--route-workers", type=int, default=ROUTE_WORKERS)
+    args = parser.parse_args(argv)
+    service = ShopService(args.layout, args.route_workers, args.inventory)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print(" Shop service stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,568 @@
+import base64
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# where the shop keeps its layout, inventory and cart; a .db path selects SQLite
+LAYOUT_FILE = os.environ.get("SHOP_LAYOUT_FILE", "layout_data.json")
+CART_FILE = os.environ.get("SHOP_CART_FILE", "cart.json")
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# inventory files with one JSON record per line, read without parsing the whole file
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+# open SQLite stores, one connection per path per process
+_opened = {}
+# callbacks run after a layout is saved, see on_layout_saved
+_layout_listeners = []
+# FileLocks handed out by file_lock, one per path per process
+_locks = {}
+_locks_guard = threading.Lock()
+
+def is_sqlite_path(path):
+    return str(path).lower().endswith(SQLITE_SUFFIXES)
+
+def open_storage(path=LAYOUT_FILE):
+    """
+    Storage backend for path: SqliteStorage for .db files, JsonStorage otherwise.
+    """
+    if not is_sqlite_path(path):
+        return JsonStorage(path)
+    key = os.path.abspath(path)
+    if key not in _opened:
+        _opened[key] = SqliteStorage(path)
+    return _opened[key]
+
+def on_layout_saved(listener):
+    """
+    Call listener(path) whenever a backend in this process saves a layout,
+    e.g. to drop anything derived from the old distances.
+    """
+    _layout_listeners.append(listener)
+
+def _layout_saved(path):
+    for listener in _layout_listeners:
+        listener(path)
+
+class FileLock:
+    """
+    Exclusive lock shared by every process that opens the same path, and by
+    threads within one process. Use as a context manager; a thread already
+    holding it may enter again. last_wait and wait_total record how long the
+    outermost acquisitions blocked, in seconds.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.acquired = 0
+        self.last_wait = 0.0
+        self.wait_total = 0.0
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return self
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds, keep waiting
+                    pass
+        self.last_wait = time.perf_counter() - started
+        self.acquired += 1
+        self.wait_total += self.last_wait
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        self._thread_lock.release()
+
+def file_lock(path):
+    """
+    The FileLock every writer of path in this process shares, on path + ".lock".
+    Sharing one object lets a thread that already holds it write again.
+    """
+    key = os.path.abspath(path)
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = FileLock(path + ".lock")
+        return _locks[key]
+
+def write_json_atomic(path, data, tmp=None, **dump_args):
+    """
+    Write data to path as JSON through a temporary file, so readers and a
+    crash mid-write see either the old file or the new one; returns the
+    bytes written. tmp defaults to path + ".tmp", which writers not holding
+    file_lock(path) must replace with a name of their own.
+    """
+    payload = json.dumps(data, **dump_args).encode("utf-8")
+    tmp = tmp or path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(payload)
+
+def _inventory_record(record):
+    # inventory rows are [price, name, brand, quantity]; quantity may be missing
+    if len(record) == 4:
+        return tuple(record)
+    if len(record) == 3:
+        p, n, b = record
+        return (p, n, b, 0)
+    return None
+
+def is_ndjson_path(path):
+    return str(path).lower().endswith(NDJSON_SUFFIXES)
+
+def _ndjson_records(f):
+    with f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = _inventory_record(json.loads(line))
+            if record is not None:
+                yield record
+        metrics.add("inventory_bytes_read", f.tell())
+
+def iter_ndjson_inventory(path):
+    """
+    Records of an NDJSON inventory file, one [price, name, brand, quantity]
+    array per line, parsed as they are read. Opens the file at once, so a
+    missing file raises FileNotFoundError here rather than on first use.
+    """
+    return _ndjson_records(open(path, "rb"))
+
+def write_ndjson_inventory(path, rows):
+    """
+    Write rows to path as NDJSON through a temporary file, so readers see
+    either the old file or the new one; returns the bytes written.
+    """
+    tmp = path + ".tmp"
+    written = 0
+    with open(tmp, "wb") as f:
+        for row in rows:
+            line = (json.dumps(list(row)) + "\n").encode("utf-8")
+            f.write(line)
+            written += len(line)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    metrics.add("inventory_bytes_written", written)
+    return written
+
+def is_sparse(distance_map):
+    return isinstance(distance_map, dict) and distance_map.get("format") == "csr"
+
+def _pack(typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return base64.b64encode(data.tobytes()).decode("ascii")
+
+def _unpack(typecode, text):
+    data = array(typecode)
+    data.frombytes(base64.b64decode(text))
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+def iter_edges(distance_map):
+    """
+    Directed (rack_a, rack_b, distance) for every real edge, from either the
+    sparse format or the old {"A->B": distance or "∞"} map.
+    """
+    if is_sparse(distance_map):
+        nodes = distance_map["nodes"]
+        offsets = _unpack("i", distance_map["offsets"])
+        targets = _unpack("i", distance_map["targets"])
+        weights = _unpack("d", distance_map["weights"])
+        directed = distance_map.get("directed", False)
+        for i, a in enumerate(nodes):
+            for k in range(offsets[i], offsets[i + 1]):
+                b, w = nodes[targets[k]], weights[k]
+                yield a, b, w
+                if not directed:
+                    yield b, a, w
+        return
+    for key, value in distance_map.items():
+        if "->" not in key:
+            continue
+        try:
+            weight = float('inf') if str(value) == "∞" else float(value)
+        except ValueError:
+            continue
+        if weight != float('inf'):
+            a, b = key.split("->", 1)
+            yield a, b, weight
+
+def encode_distances(distance_map, rack_ids=()):
+    """
+    Sparse CSR form of a distance map: node list plus base64 little-endian
+    offsets/targets (int32) and weights (float64). Only real edges are kept,
+    and when every edge has a matching reverse edge each pair is stored once.
+    """
+    if is_sparse(distance_map):
+        return distance_map
+    edges = {}
+    nodes = dict.fromkeys(rack_ids)
+    for a, b, w in iter_edges(distance_map):
+        edges[(a, b)] = w
+        nodes.setdefault(a)
+        nodes.setdefault(b)
+    nodes = list(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    directed = any(edges.get((b, a)) != w for (a, b), w in edges.items())
+
+    rows = [[] for _ in nodes]
+    for (a, b), w in edges.items():
+        i, j = index[a], index[b]
+        if directed or i < j:
+            rows[i].append((j, w))
+    offsets, targets, weights = [0], [], []
+    for row in rows:
+        row.sort()
+        targets.extend(j for j, w in row)
+        weights.extend(w for j, w in row)
+        offsets.append(len(targets))
+    return {
+        "format": "csr",
+        "directed": directed,
+        "nodes": nodes,
+        "offsets": _pack("i", offsets),
+        "targets": _pack("i", targets),
+        "weights": _pack("d", weights),
+    }
+
+class JsonStorage:
+    """
+    Whole-document backend over layout_data.json and cart.json.
+    Every read parses the full file and every write rewrites it.
+    """
+    def __init__(self, filename="layout_data.json", cart_file=CART_FILE):
+        self.filename = filename
+        self.cart_file = cart_file
+
+    def _read(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load_layout(self):
+        with open(self.filename, "r") as f, metrics.timer("layout_json_parse"):
+            data = json.load(f)
+            metrics.add("layout_bytes_read", f.tell())
+        if self._is_legacy(data):
+            # files from before the sparse format are converted on first read;
+            # re-read under the lock so a write that landed meanwhile is kept
+            with file_lock(self.filename):
+                data = self._read()
+                if self._is_legacy(data):
+                    data["distances"] = encode_distances(data["distances"], data.get("rack_ids", []))
+                    self._write(data)
+        return data
+
+    @staticmethod
+    def _is_legacy(data):
+        return isinstance(data, dict) and bool(data.get("distances")) and not is_sparse(data["distances"])
+
+    def _write(self, data):
+        # inventory saves and journal compaction rewrite the same file under this lock
+        with file_lock(self.filename):
+            written = write_json_atomic(self.filename, data, indent=4)
+        metrics.add("layout_bytes_written", written)
+
+    def save_layout(self, data):
+        with file_lock(self.filename):
+            # preserve existing inventory if present so we don't clobber product inventory
+            existing = self._read()
+            if isinstance(existing, dict) and "inventory" in existing:
+                data.setdefault("inventory", existing.get("inventory"))
+            if "distances" in data:
+                data["distances"] = encode_distances(data["distances"], data.get("rack_ids", []))
+            self._write(data)
+        _layout_saved(self.filename)
+
+    def assign_product(self, rack, product):
+        with file_lock(self.filename):
+            data = self.load_layout()
+            products = data.setdefault("products", {})
+            current = products.get(rack)
+            if isinstance(current, str):
+                current = [] if current.strip().lower() in ("", "unassigned") else [current]
+            items = current or []
+            if product not in items:
+                items.append(product)
+            # keep the plain string form for single-product racks
+            products[rack] = items[0] if len(items) == 1 else items
+            self._write(data)
+
+    def load_inventory(self):
+        data = self._read()
+        records = data if isinstance(data, list) else data.get("inventory", [])
+        rows = [_inventory_record(r) for r in records or []]
+        return [r for r in rows if r is not None]
+
+    def save_inventory(self, rows):
+        with file_lock(self.filename):
+            data = self._read()
+            if not isinstance(data, dict):
+                data = {}
+            data["inventory"] = [list(r) for r in rows]
+            self._write(data)
+
+    def load_cart(self, cart_id="default"):
+        try:
+            with open(self.cart_file, "r") as f:
+                return [tuple(line) for line in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def save_cart(self, lines, cart_id="default"):
+        with open(self.cart_file, "w") as f:
+            json.dump([list(line) for line in lines], f)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS racks (
+    rack_id  TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS edges (
+    a        TEXT NOT NULL,
+    b        TEXT NOT NULL,
+    distance REAL NOT NULL,
+    PRIMARY KEY (a, b)
+);
+CREATE TABLE IF NOT EXISTS cashiers (
+    rack_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    rack_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    PRIMARY KEY (rack_id, product)
+);
+CREATE INDEX IF NOT EXISTS assignments_by_product ON assignments (lower(product));
+CREATE TABLE IF NOT EXISTS inventory (
+    name      TEXT NOT NULL,
+    brand_key TEXT NOT NULL,
+    brand     TEXT NOT NULL,
+    price     REAL NOT NULL,
+    quantity  INTEGER NOT NULL,
+    PRIMARY KEY (name, brand_key)
+);
+CREATE INDEX IF NOT EXISTS inventory_by_price ON inventory (price);
+CREATE TABLE IF NOT EXISTS carts (
+    cart_id  TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    brand    TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (cart_id, name, brand)
+);
+"""
+
+class SqliteStorage:
+    """
+    Row-level backend: inventory, rack assignments, edges and carts live in
+    indexed tables. Point writes join the open transaction until commit().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def commit(self):
+        self.conn.commit()
+
+    def data_version(self):
+        # changes whenever another connection commits to the database
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # layout
+
+    def load_layout(self):
+        rack_ids = [r for (r,) in self.conn.execute(
+            "SELECT rack_id FROM racks ORDER BY position")]
+        distances = encode_distances({
+            f"{a}->{b}": d
+            for a, b, d in self.conn.execute("SELECT a, b, distance FROM edges")
+        }, rack_ids)
+        assigned = {}
+        for rack, product in self.conn.execute(
+                "SELECT rack_id, product FROM assignments ORDER BY rowid"):
+            assigned.setdefault(rack, []).append(product)
+        products = {
+            rack: items[0] if len(items) == 1 else items
+            for rack, items in assigned.items()
+        }
+        cashiers = [r for (r,) in self.conn.execute(
+            "SELECT rack_id FROM cashiers ORDER BY rowid")]
+        layout = {"rack_ids": rack_ids, "distances": distances, "products": products}
+        if cashiers:
+            layout["cashiers"] = cashiers
+        return layout
+
+    def save_layout(self, data):
+        with self.conn:
+            self.conn.execute("DELETE FROM racks")
+            self.conn.execute("DELETE FROM edges")
+            self.conn.execute("DELETE FROM assignments")
+            self.conn.execute("DELETE FROM cashiers")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO cashiers (rack_id) VALUES (?)",
+                [(r,) for r in data.get("cashiers", [])])
+            self.conn.executemany(
+                "INSERT INTO racks (rack_id, position) VALUES (?, ?)",
+                [(r, i) for i, r in enumerate(data.get("rack_ids", []))])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO edges (a, b, distance) VALUES (?, ?, ?)",
+                iter_edges(data.get("distances", {})))
+            for rack, items in data.get("products", {}).items():
+                self._insert_assignments(rack, items)
+            if data.get("inventory"):
+                self.save_inventory(
+                    r for r in map(_inventory_record, data["inventory"]) if r)
+        _layout_saved(self.path)
+
+    def _insert_assignments(self, rack, items):
+        if isinstance(items, str):
+            items = [items]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO assignments (rack_id, product) VALUES (?, ?)",
+            [(rack, item) for item in items])
+
+    def assign_product(self, rack, product):
+        # racks hold any number of products; drop the placeholder first
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM assignments WHERE rack_id = ? AND lower(product) = 'unassigned'",
+                (rack,))
+            self._insert_assignments(rack, product)
+
+    def racks_for_product(self, product):
+        return [r for (r,) in self.conn.execute(
+            "SELECT rack_id FROM assignments WHERE lower(product) = ?",
+            (product.strip().lower(),))]
+
+    # inventory
+
+    def load_inventory(self):
+        return list(self.conn.execute(
+            "SELECT price, name, brand, quantity FROM inventory"))
+
+    def save_inventory(self, rows):
+        with self.conn:
+            self.conn.execute("DELETE FROM inventory")
+            for row in rows:
+                self.put_item(row)
+
+    def get_item(self, name, brand):
+        return self.conn.execute(
+            "SELECT price, name, brand, quantity FROM inventory"
+            " WHERE name = ? AND brand_key = ?",
+            (name.lower(), brand.lower())).fetchone()
+
+    def put_item(self, row):
+        p, n, b, q = row
+        self.conn.execute(
+            "INSERT OR REPLACE INTO inventory (name, brand_key, brand, price, quantity)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (n.lower(), b.lower(), b, p, q))
+
+    def swap_quantity(self, name, brand, expected, quantity):
+        """
+        Set the stock of name/brand to quantity only if it still holds
+        expected, committing at once. False when another writer got there first.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE inventory SET quantity = ?"
+                " WHERE name = ? AND brand_key = ? AND quantity = ?",
+                (quantity, name.lower(), brand.lower(), expected))
+        return cursor.rowcount == 1
+
+    def delete_item(self, name, brand):
+        self.conn.execute(
+            "DELETE FROM inventory WHERE name = ? AND brand_key = ?",
+            (name.lower(), brand.lower()))
+
+    # carts
+
+    def load_cart(self, cart_id="default"):
+        return list(self.conn.execute(
+            "SELECT name, brand, quantity FROM carts WHERE cart_id = ?", (cart_id,)))
+
+    def save_cart(self, lines, cart_id="default"):
+        with self.conn:
+            self.clear_cart(cart_id)
+            for n, b, qty in lines:
+                self.put_cart_line(n, b, qty, cart_id)
+
+    def put_cart_line(self, name, brand, qty, cart_id="default"):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO carts (cart_id, name, brand, quantity)"
+            " VALUES (?, ?, ?, ?)",
+            (cart_id, name, brand, qty))
+
+    def delete_cart_line(self, name, brand, cart_id="default"):
+        self.conn.execute(
+            "DELETE FROM carts WHERE cart_id = ? AND name = ? AND brand = ?",
+            (cart_id, name, brand))
+
+    def clear_cart(self, cart_id="default"):
+        self.conn.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+
+def migrate_json_to_sqlite(json_file="layout_data.json", db_file="shop.db",
+                           cart_file=CART_FILE):
+    """
+    One-shot copy of layout, inventory and cart from the JSON files into db_file.
+    """
+    source = JsonStorage(json_file, cart_file)
+    target = open_storage(db_file)
+    layout = source.load_layout()
+    target.save_layout({
+        "rack_ids": layout.get("rack_ids", []),
+        "distances": layout.get("distances", {}),
+        "products": layout.get("products", {}),
+        "cashiers": layout.get("cashiers", []),
+    })
+    target.save_inventory(source.load_inventory())
+    target.save_cart(source.load_cart())
+    return target
+
+if __name__ == "__main__":
+    import sys
+    src = sys.argv[1] if len(sys.argv) > 1 else "layout_data.json"
+    dst = sys.argv[2] if len(sys.argv) > 2 else "shop.db"
+    migrate_json_to_sqlite(src, dst)
+    print(f"Migrated {src} into {dst}")
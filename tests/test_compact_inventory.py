@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+
+from compact_inventory import CompactInventory
+from shop_algorithms import PersistenceWorker, ProductHeap
+
+
+class MatchesProductHeapTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "inventory.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def apply_random_operations(self, stores, seed, count=500):
+        rng = random.Random(seed)
+        names = [f"Item{i}" for i in range(40)]
+        brands = ["Acme", "Bolt", "acme", "Cora", "Dune"]
+        for _ in range(count):
+            name, brand = rng.choice(names), rng.choice(brands)
+            op, price = rng.random(), float(rng.randint(1, 50))
+            for store in stores:
+                if op < 0.5:
+                    store.add_product(name, brand, price, 10)
+                elif op < 0.65:
+                    store.delete_product(name, brand)
+                elif op < 0.8:
+                    store.update_product(name, brand, price=round(op * 100, 2))
+                else:
+                    store.reserve(name, brand, -3)
+
+    def assertSameQueries(self, heap, compact):
+        self.assertEqual(sorted(heap.heap), sorted(tuple(r) for r in compact.heap))
+        for keyword in ("", "it", "item1", "em3", "acm", "ACME", "cor", "zzz"):
+            self.assertEqual(sorted(heap.search_by_keyword(keyword)),
+                             sorted(compact.search_by_keyword(keyword)), keyword)
+        self.assertEqual(heap.cheapest(15), compact.cheapest(15))
+        self.assertEqual(heap.in_price_range(10, 30), compact.in_price_range(10, 30))
+        for name in ("item3", "Item17", "missing"):
+            self.assertEqual(heap.brands_by_price(name), compact.brands_by_price(name))
+            self.assertEqual(heap.get(name, "acme"), compact.get(name, "acme"))
+
+    def test_random_operations_match(self):
+        heap, compact = ProductHeap(filename=self.path), CompactInventory(filename=self.path)
+        self.apply_random_operations((heap, compact), seed=1)
+        self.assertSameQueries(heap, compact)
+
+    def test_reads_what_product_heap_saved(self):
+        heap = ProductHeap(filename=self.path)
+        self.apply_random_operations((heap,), seed=2)
+        heap.save_to_file()
+        compact = CompactInventory(filename=self.path)
+        compact.load_from_file()
+        self.assertSameQueries(heap, compact)
+
+    def test_worker_saves_only_changes(self):
+        heap = ProductHeap(filename=self.path)
+        self.apply_random_operations((heap,), seed=3)
+        heap.save_to_file()
+        worker = PersistenceWorker()
+        compact = CompactInventory(filename=self.path, worker=worker)
+        compact.load_from_file()
+        self.apply_random_operations((heap, compact), seed=4, count=50)
+        self.assertLessEqual(len(compact._changes), 50)
+        compact.save_to_file()
+        worker.flush()
+
+        reloaded = ProductHeap(filename=self.path)
+        reloaded.load_from_file()
+        self.assertEqual(sorted(reloaded.heap), sorted(heap.heap))
+
+    def test_rows_order_like_tuples(self):
+        compact = CompactInventory(filename=self.path)
+        compact.add_product("b", "x", 2.0, 1)
+        compact.add_product("a", "x", 2.0, 1)
+        compact.add_product("c", "x", 1.0, 1)
+        self.assertEqual([tuple(r) for r in sorted(compact.heap)],
+                         [(1.0, "c", "x", 1), (2.0, "a", "x", 1), (2.0, "b", "x", 1)])
+        with self.assertRaises(TypeError):
+            hash(compact.heap[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
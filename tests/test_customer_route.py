@@ -0,0 +1,47 @@
+import itertools
+import random
+import unittest
+
+from customer_route import held_karp
+
+INF = float('inf')
+
+
+def brute_force(all_distances, sequence):
+    start, best = sequence[0], INF
+    for rest in itertools.permutations(sequence[1:]):
+        order = (start,) + rest
+        best = min(best, sum(all_distances[a][b] for a, b in zip(order, order[1:])))
+    return best
+
+
+def random_distances(rng, racks, symmetric, missing):
+    # missing is the share of pairs without a path
+    distances = {a: {a: 0.0} for a in racks}
+    for a, b in itertools.combinations(racks, 2):
+        forward = INF if rng.random() < missing else float(rng.randint(1, 30))
+        backward = INF if rng.random() < missing else float(rng.randint(1, 30))
+        distances[a][b], distances[b][a] = forward, forward if symmetric else backward
+    return distances
+
+
+class HeldKarpTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        for trial in range(300):
+            racks = [f"R{i}" for i in range(rng.randint(1, 7))]
+            distances = random_distances(rng, racks, symmetric=trial % 2 == 0,
+                                         missing=rng.choice([0.0, 0.3]))
+            order, cost = held_karp(distances, racks)
+            expected = brute_force(distances, racks)
+            self.assertEqual(cost, expected, (distances, order))
+            if expected == INF:
+                self.assertEqual(order, [])
+                continue
+            self.assertEqual(order[0], racks[0])
+            self.assertEqual(sorted(order), sorted(racks))
+            self.assertEqual(sum(distances[a][b] for a, b in zip(order, order[1:])), cost)
+
+
+if __name__ == "__main__":
+    unittest.main()
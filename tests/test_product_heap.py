@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import unittest
+
+from shop_algorithms import ProductHeap
+
+
+class PositionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "inventory.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def assertInvariants(self, heap, expected):
+        records = heap.heap
+        for i in range(1, len(records)):
+            self.assertLessEqual(records[(i - 1) // 2], records[i])
+        self.assertEqual(len(heap._positions), len(records))
+        for i, (p, n, b, q) in enumerate(records):
+            self.assertEqual(heap._positions[ProductHeap._key(n, b)], i)
+        self.assertEqual(heap._by_price, sorted((r[0], key) for key, r in expected.items()))
+        brands = {}
+        for key, r in expected.items():
+            brands.setdefault(key[0], []).append((r[0], key[1]))
+        self.assertEqual(heap._brands, {name: sorted(v) for name, v in brands.items()})
+        self.assertEqual(sorted(records), sorted(expected.values()))
+
+    def random_operation(self, rng, heap, expected):
+        name, brand = f"item{rng.randrange(30)}", rng.choice(["Acme", "bolt", "Cora"])
+        key = ProductHeap._key(name, brand)
+        op = rng.random()
+        if op < 0.4:
+            record = (float(rng.randint(1, 20)), name, brand, rng.randint(0, 5))
+            heap.add_product(name, brand, record[0], record[3])
+            expected[key] = (record[0], name.lower(), brand, record[3])
+        elif op < 0.55:
+            heap.delete_product(name, brand)
+            expected.pop(key, None)
+        elif op < 0.75:
+            price = float(rng.randint(1, 20))
+            self.assertEqual(heap.update_product(name, brand, price=price), key in expected)
+            if key in expected:
+                expected[key] = (price,) + expected[key][1:]
+        else:
+            change = rng.randint(-3, 3)
+            ok = key in expected and expected[key][3] + change >= 0
+            self.assertEqual(heap.reserve(name, brand, change), ok)
+            if ok:
+                p, n, b, q = expected[key]
+                expected[key] = (p, n, b, q + change)
+
+    def test_random_operations_keep_invariants(self):
+        rng = random.Random(4)
+        heap, expected = ProductHeap(filename=self.path), {}
+        for _ in range(2000):
+            self.random_operation(rng, heap, expected)
+            self.assertInvariants(heap, expected)
+        for key, record in expected.items():
+            self.assertEqual(heap.get(*key), record)
+        by_price = sorted(expected.values(), key=lambda r: (r[0], ProductHeap._key(r[1], r[2])))
+        self.assertEqual(heap.cheapest(5), by_price[:5])
+
+    def test_changes_between_pages_survive_the_load(self):
+        rng = random.Random(5)
+        seed, expected = ProductHeap(filename=self.path), {}
+        for _ in range(300):
+            self.random_operation(rng, seed, expected)
+        seed.save_to_file()
+
+        heap = ProductHeap(filename=self.path)
+        pages = heap.load_pages(page_size=16)
+        next(pages)
+        for _ in range(50):
+            self.random_operation(rng, heap, expected)
+        self.assertEqual(list(pages)[-1:], [len(expected)])
+        self.assertInvariants(heap, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from shop_algorithms import ProductHeap
+
+TILLS = 4
+ATTEMPTS = 60
+STOCK = 150
+
+
+def till(filename, results):
+    # one process selling one unit at a time until its attempts run out
+    heap = ProductHeap(filename=filename, shared=True)
+    heap.load_from_file()
+    sold = 0
+    for _ in range(ATTEMPTS):
+        if heap.reserve("water", "knuckles", -1):
+            sold += 1
+        heap.save_to_file()
+    heap.compact(wait=True)
+    results.put(sold)
+
+
+class SharedReservationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def sell_concurrently(self, filename):
+        seed = ProductHeap(filename=filename)
+        seed.add_product("water", "Knuckles", 70.0, STOCK)
+        seed.save_to_file()
+        # spawn, not fork: children must not share the parent's sqlite handles
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        tills = [context.Process(target=till, args=(filename, results)) for _ in range(TILLS)]
+        for process in tills:
+            process.start()
+        sold = sum(results.get(timeout=120) for _ in tills)
+        for process in tills:
+            process.join()
+        return sold
+
+    def assertSoldOut(self, filename, sold):
+        # more attempts than stock: every unit sold exactly once
+        self.assertEqual(sold, STOCK)
+        heap = ProductHeap(filename=filename, journal=True)
+        heap.load_from_file()
+        self.assertEqual(heap.get("water", "knuckles")[3], 0)
+
+    def test_file_lock_with_journal(self):
+        filename = os.path.join(self.dir.name, "inventory.json")
+        self.assertSoldOut(filename, self.sell_concurrently(filename))
+
+    def test_compare_and_swap_on_sqlite(self):
+        filename = os.path.join(self.dir.name, "inventory.db")
+        self.assertSoldOut(filename, self.sell_concurrently(filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import base64
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from storage import encode_distances, iter_edges, open_storage
+
+
+def random_layout(rng, count, directed):
+    racks = [f"R{i}" for i in range(count)]
+    distances = {}
+    for a in racks:
+        for b in racks:
+            if a >= b:
+                continue
+            weight = rng.choice(["∞", "∞", rng.randint(1, 9), rng.random() * 10])
+            distances[f"{a}->{b}"] = weight
+            distances[f"{b}->{a}"] = rng.randint(1, 9) if directed and weight != "∞" else weight
+    return racks, distances
+
+
+def real_edges(distances):
+    return {tuple(key.split("->")): float(value)
+            for key, value in distances.items() if value != "∞"}
+
+
+class CsrRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_iter_edges_returns_what_was_encoded(self):
+        rng = random.Random(13)
+        for trial in range(50):
+            directed = trial % 2 == 1
+            racks, distances = random_layout(rng, rng.randint(1, 12), directed)
+            # an isolated rack is kept as a node
+            racks.append("LONE")
+            encoded = json.loads(json.dumps(encode_distances(distances, racks)))
+
+            edges = {(a, b): w for a, b, w in iter_edges(encoded)}
+            self.assertEqual(edges, real_edges(distances))
+            self.assertEqual(edges, {(a, b): w for a, b, w in iter_edges(distances)})
+            self.assertEqual(encoded["nodes"][:len(racks)], racks)
+            # int32 targets, each undirected pair stored once
+            stored = len(base64.b64decode(encoded["targets"])) // 4
+            self.assertEqual(stored, len(edges) if encoded["directed"] else len(edges) // 2)
+            self.assertIs(encode_distances(encoded), encoded)
+
+    def test_layout_file_keeps_the_edges(self):
+        racks, distances = random_layout(random.Random(7), 8, directed=True)
+        path = os.path.join(self.dir.name, "layout_data.json")
+        open_storage(path).save_layout({"rack_ids": racks, "distances": distances})
+        loaded = open_storage(path).load_layout()
+        self.assertEqual(loaded["rack_ids"], racks)
+        self.assertEqual({(a, b): w for a, b, w in iter_edges(loaded["distances"])},
+                         real_edges(distances))
+
+
+if __name__ == "__main__":
+    unittest.main()